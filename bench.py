@@ -0,0 +1,142 @@
+#!/bin/env python3
+from argparse import ArgumentParser
+from array import array
+from dataclasses import fields
+import io
+from time import process_time
+import tracemalloc
+from typing import Callable
+
+import yaml
+
+import cmds # imported before code_parser, which it depends on
+from code_parser import TokenStream
+from functions import FunctionDef, analyze_function_def, function_symbol_ids, print_function_imports, read_function_definitions
+from main import open_ksm_file, read_ksm_container
+from other_types import Expr, write_expr_or_var
+from tables import print_tables
+from util import SymbolIds
+from variables import write_variables_yaml
+
+# measures single stages of the conversion on a script written by samples.py, e.g.
+#   python3 samples.py samples
+#   python3 bench.py tokenize samples/large.bin
+# times are CPU times, the best of several runs
+
+def best_time[T](setup: Callable[[], T], run: Callable[[T], object], repeat: int) -> float:
+    # the setup isn't timed, it's done again before every run
+    best = float('inf')
+    
+    for _ in range(repeat):
+        value = setup()
+        start = process_time()
+        run(value)
+        best = min(best, process_time() - start)
+    
+    return best
+
+def read_script(filename: str) -> tuple[list[FunctionDef], SymbolIds]:
+    # the function definitions with every symbol their code can refer to, like write_ksm_yaml reads them
+    sections = read_ksm_container(open_ksm_file(filename))
+    symbol_ids = SymbolIds()
+    
+    write_variables_yaml(sections, symbol_ids, io.StringIO())
+    list(print_function_imports(sections, symbol_ids))
+    list(print_tables(sections, symbol_ids))
+    
+    definitions = read_function_definitions(sections[1], sections[7])
+    for fn in definitions:
+        symbol_ids.add(fn)
+    
+    return definitions, symbol_ids
+
+def decode_functions(definitions: list[FunctionDef], symbol_ids: SymbolIds) -> int:
+    instructions = 0
+    
+    for fn in definitions:
+        if len(fn.code) > 0:
+            analyze_function_def(fn, function_symbol_ids(fn, symbol_ids))
+            instructions += len(fn.instructions)
+    
+    return instructions
+
+def bench_tokenize(filename: str, repeat: int):
+    # every instruction line of the yaml file, fully consumed through TokenStream
+    with open(filename + '.yaml', encoding='utf-8') as f:
+        definitions = yaml.load(f, Loader=yaml.SafeLoader).get('definitions') or []
+    
+    lines = [line for fn in definitions for line in fn.get('body') or []]
+    
+    def run(lines: list[str]):
+        for line in lines:
+            tokens = TokenStream(line)
+            
+            while tokens.advance() != '':
+                pass
+    
+    elapsed = best_time(lambda: lines, run, repeat)
+    print(f"tokenize: {len(lines)} lines in {elapsed:.3f}s, {len(lines) / elapsed:,.0f} lines/s")
+
+def bench_decode(filename: str, repeat: int):
+    # the instructions of every function, without printing them
+    instructions = decode_functions(*read_script(filename))
+    
+    elapsed = best_time(lambda: read_script(filename), lambda script: decode_functions(*script), repeat)
+    print(f"decode: {instructions} instructions in {elapsed:.3f}s, {instructions / elapsed:,.0f} instructions/s")
+
+def bench_memory(filename: str, repeat: int):
+    # the memory the decoded instructions hold on to, which is the same for every run.
+    # expressions are only decoded when they get printed, so this doesn't include their elements
+    definitions, symbol_ids = read_script(filename)
+    
+    tracemalloc.start()
+    instructions = decode_functions(definitions, symbol_ids)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(f"memory: {instructions} instructions hold {retained / 1e6:.2f} MB, {retained / instructions:.0f} bytes per instruction")
+
+def bench_encode(filename: str, repeat: int):
+    # every expression of the decoded instructions written back to words. They're copied with their decoded elements
+    # beforehand, so only writing them is timed
+    definitions, symbol_ids = read_script(filename)
+    decode_functions(definitions, symbol_ids)
+    
+    expressions: list[Expr] = []
+    
+    for fn in definitions:
+        for cmd in fn.instructions or []:
+            for cmd_field in fields(cmd):
+                value = getattr(cmd, cmd_field.name)
+                values = value if isinstance(value, list) else [value]
+                expressions.extend(Expr(value.elements) for value in values if isinstance(value, Expr))
+    
+    elements = sum(len(expr.elements) for expr in expressions)
+    
+    def run(expressions: list[Expr]):
+        out = array('I')
+        
+        for expr in expressions:
+            write_expr_or_var(expr, out)
+    
+    elapsed = best_time(lambda: expressions, run, repeat)
+    print(f"encode: {len(expressions)} expressions ({elements} elements) in {elapsed:.3f}s, {elements / elapsed:,.0f} elements/s")
+
+STAGES = {
+    'tokenize': bench_tokenize,
+    'decode': bench_decode,
+    'memory': bench_memory,
+    'encode': bench_encode,
+}
+
+def main():
+    parser = ArgumentParser(description="Benchmarks a stage of the conversion on a script written by samples.py")
+    parser.add_argument('stage', choices=STAGES)
+    parser.add_argument('input', help="a .bin file written by samples.py, with its yaml files next to it")
+    parser.add_argument('-n', '--repeat', type=int, default=5, help="runs to take the best time of")
+    
+    args = parser.parse_args()
+    STAGES[args.stage](args.input, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import pickle
+from typing import Any
+
+# has to be changed whenever the pickled classes change, so caches written by an older version get ignored
+CACHE_VERSION = 2
+
+def cache_filename(filename: str) -> str:
+    return filename + '.cache'
+
+class InputFiles:
+    """The files a cache entry is derived from. They are only read when the cache can't be used."""
+    filenames: list[str]
+    stamps: list[tuple[str, int, int]]
+    
+    def __init__(self, filenames: list[str]):
+        self.filenames = filenames
+        self.stamps = []
+        self._contents: list[bytes] | None = None
+        
+        for filename in filenames:
+            stat = os.stat(filename)
+            self.stamps.append((os.path.abspath(filename), stat.st_mtime_ns, stat.st_size))
+    
+    @property
+    def contents(self) -> list[bytes]:
+        if self._contents is None:
+            self._contents = []
+            
+            for filename in self.filenames:
+                with open(filename, 'rb') as f:
+                    self._contents.append(f.read())
+        
+        return self._contents
+    
+    def digest(self) -> bytes:
+        # the hash of exactly the contents that get parsed, even if a file changes in the meantime
+        digest = hashlib.blake2b()
+        
+        for content in self.contents:
+            digest.update(len(content).to_bytes(8, 'little'))
+            digest.update(content)
+        
+        return digest.digest()
+
+def load_cached(cache_file: str, inputs: InputFiles, options: tuple) -> tuple[Any, bool] | None:
+    """Returns the cached value and whether the inputs still have the same modification time or contents.
+    An outdated value is still returned, as it can be used to only redo the parts of the work that changed."""
+    try:
+        with open(cache_file, 'rb') as f:
+            # the header is a pickle of its own, so a value written by another version never gets unpickled
+            version, cached_options, stamps, digest = pickle.load(f)
+            
+            if version != CACHE_VERSION or cached_options != options:
+                return None
+            
+            up_to_date = stamps == inputs.stamps or digest == inputs.digest()
+            return pickle.load(f), up_to_date
+    except Exception:
+        # a missing or broken cache is the same as none at all
+        return None
+
+def store_cached(cache_file: str, inputs: InputFiles, options: tuple, value: Any):
+    # written to a temporary file first, so an interrupted write can't leave a truncated cache behind
+    temp_file = cache_file + '.tmp'
+    
+    with open(temp_file, 'wb') as f:
+        pickle.dump((CACHE_VERSION, options, inputs.stamps, inputs.digest()), f)
+        pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+    
+    os.replace(temp_file, cache_file)
@@ -1,59 +1,84 @@
 from array import array
 from dataclasses import dataclass, replace
-from typing import Any, Callable
+import json
+from typing import Any, Callable, Iterator
 
 import functions
-from other_types import EXPR_SYMBOLS, Expr, Label, ScriptImport, read_expr, write_expr_or_var
+from other_types import EXPR_SYMBOLS, EXPR_SYMBOLS_BY_LABEL, Expr, ExprSymbol, Label, ScriptImport, read_expr, write_expr_or_var
 from tables import Table
-from code_parser import TokenStream, get_func_from_name, is_identifier, read_function_id, read_var_ref
+from code_parser import STRING_PATTERN, TokenStream, read_arg_list, read_call, read_call_args, read_const_marker, read_expr_value, read_expression, \
+    read_function_id, read_symbol_name
 from util import SymbolIds
-from variables import Var, VarCategory
+from variables import ConstantPool, Var, VarCategory
 
-type ReadCmdFunc = Callable[[enumerate[int], SymbolIds, ReadCmdOptions], Any]
+type ReadCmdFunc = Callable[[Iterator[int], SymbolIds, ReadCmdOptions], Any]
 type WriteCmdFunc[T] = Callable[[T, array[int]], Any]
 
-class InstructionRegistry:
-    def __init__(self):
-        self.readers: dict[int, ReadCmdFunc] = {}
-        self.writers: dict[type, WriteCmdFunc] = {}
-
 @dataclass
 class ReadCmdOptions:
     opcode: int
     is_const: bool
     cmd_offset: int | None = None
+    # the code of the function that's being decoded, expressions refer to their words in it
+    code: array[int] | memoryview | None = None
+
+# decoding table entry: reader, shared options (which readers must not modify), whether the reader needs cmd_offset,
+# whether the instruction opens, continues or closes a block (the decoder keeps their offsets to check where jumps point)
+type DispatchEntry = tuple[ReadCmdFunc, ReadCmdOptions, bool, bool]
+
+CONST_BIT = 0x100
+
+class InstructionRegistry:
+    def __init__(self):
+        self.readers: dict[int, ReadCmdFunc] = {}
+        self.writers: dict[type, WriteCmdFunc] = {}
+        
+        # indexed by the whole instruction word (opcode | CONST_BIT), so decoding
+        # an instruction is a single list lookup without masking or allocating options
+        self.dispatch: list[DispatchEntry | None] = [None] * (CONST_BIT * 2)
+
+def cmd_word(opcode: int, is_const: bool = False) -> int:
+    # every instruction starts with its opcode, const variants have CONST_BIT set
+    return opcode | (CONST_BIT if is_const else 0)
 
 # command definitions
-@dataclass
+@dataclass(slots=True)
 class ReturnValCmd:
     is_const: bool
     value: Expr | Var | int
 
-def read_returnval_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReturnValCmd:
-    value_int = next(arr)[1]
+def read_returnval_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReturnValCmd:
+    value_int = next(arr)
     if options.is_const:
         value = symbol_ids.get(value_int)
         assert isinstance(value, Var) or isinstance(value, int)
         if value == 0x40:
             value = Expr()
     else:
-        value = read_expr(value_int, arr, symbol_ids)
+        value = read_expr(value_int, arr, symbol_ids, options.code)
     
     return ReturnValCmd(options.is_const, value)
 
-@dataclass 
+def write_returnval_cmd(cmd: ReturnValCmd, out: array[int]):
+    out.append(cmd_word(0x3, cmd.is_const))
+    write_expr_or_var(cmd.value, out)
+
+@dataclass(slots=True)
 class CallCmd:
     is_const: bool
     func: 'ScriptImport | functions.FunctionDef | int'
     args: list[Expr | Var | int]
 
-def read_call_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallCmd:
-    func_int = next(arr)[1]
+# used for calls nested inside of expressions
+NESTED_CALL_OPTIONS = ReadCmdOptions(0xc, False)
+
+def read_call_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallCmd:
+    func_int = next(arr)
     func = symbol_ids.get(func_int)
     assert isinstance(func, ScriptImport) or isinstance(func, functions.FunctionDef) or isinstance(func, int)
     
     args = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x11:
             break
         
@@ -61,34 +86,39 @@ def read_call_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOp
             var = symbol_ids.get(value)
             args.append(var)
         else:
-            args.append(read_expr(value, arr, symbol_ids))
+            args.append(read_expr(value, arr, symbol_ids, options.code))
     
     return CallCmd(options.is_const, func, args)
 
-def write_call_cmd(cmd: CallCmd, out: array[int]):
-    if not isinstance(cmd.func, int):
-        out.append(cmd.func.id)
+def write_call_args(func: 'ScriptImport | functions.FunctionDef | Var | int', args: list[Expr | Var | int], out: array[int]):
+    # shared by all call instructions
+    if not isinstance(func, int):
+        out.append(func.id)
     else:
-        out.append(cmd.func)
+        out.append(func)
     
-    for arg in cmd.args:
+    for arg in args:
         write_expr_or_var(arg, out)
     
     out.append(0x11)
 
-@dataclass
+def write_call_cmd(cmd: CallCmd, out: array[int]):
+    out.append(cmd_word(0xc, cmd.is_const))
+    write_call_args(cmd.func, cmd.args, out)
+
+@dataclass(slots=True)
 class CallAsThreadCmd:
     is_const: bool
     func: 'ScriptImport | functions.FunctionDef | int'
     args: list[Expr | Var | int]
 
-def read_call_as_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallAsThreadCmd:
-    func_int = next(arr)[1]
+def read_call_as_thread_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallAsThreadCmd:
+    func_int = next(arr)
     func = symbol_ids.get(func_int)
     assert isinstance(func, ScriptImport) or isinstance(func, functions.FunctionDef) or isinstance(func, int)
     
     args = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x11:
             break
         
@@ -96,26 +126,30 @@ def read_call_as_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options:
             var = symbol_ids.get(value)
             args.append(var)
         else:
-            args.append(read_expr(value, arr, symbol_ids))
+            args.append(read_expr(value, arr, symbol_ids, options.code))
     
     return CallAsThreadCmd(options.is_const, func, args)
 
+def write_call_as_thread_cmd(cmd: CallAsThreadCmd, out: array[int]):
+    out.append(cmd_word(0xd, cmd.is_const))
+    write_call_args(cmd.func, cmd.args, out)
+
 # Same as CallAsThread but sets the original thread as the new thread's parent
 # This might mean that the parent thread waits for the child to be done before it continues
 # TODO: But idk if that's true
-@dataclass
+@dataclass(slots=True)
 class CallAsChildThreadCmd:
     is_const: bool
     func: 'ScriptImport | functions.FunctionDef | int'
     args: list[Expr | Var | int]
 
-def read_call_as_child_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallAsChildThreadCmd:
-    func_int = next(arr)[1]
+def read_call_as_child_thread_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallAsChildThreadCmd:
+    func_int = next(arr)
     func = symbol_ids.get(func_int)
     assert isinstance(func, ScriptImport) or isinstance(func, functions.FunctionDef) or isinstance(func, int)
     
     args = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x11:
             break
         
@@ -123,23 +157,27 @@ def read_call_as_child_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, op
             var = symbol_ids.get(value)
             args.append(var)
         else:
-            args.append(read_expr(value, arr, symbol_ids))
+            args.append(read_expr(value, arr, symbol_ids, options.code))
     
     return CallAsChildThreadCmd(options.is_const, func, args)
 
-@dataclass 
+def write_call_as_child_thread_cmd(cmd: CallAsChildThreadCmd, out: array[int]):
+    out.append(cmd_word(0xe, cmd.is_const))
+    write_call_args(cmd.func, cmd.args, out)
+
+@dataclass(slots=True)
 class CallVarCmd:
     is_const: bool
     func: Var | int
     args: list[Expr | Var | int]
 
-def read_call_var_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallVarCmd:
-    func_int = next(arr)[1]
+def read_call_var_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallVarCmd:
+    func_int = next(arr)
     func = symbol_ids.get(func_int)
     assert isinstance(func, Var) or isinstance(func, int)
     
     args = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x11:
             break
         
@@ -147,89 +185,113 @@ def read_call_var_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadC
             var = symbol_ids.get(value)
             args.append(var)
         else:
-            args.append(read_expr(value, arr, symbol_ids))
+            args.append(read_expr(value, arr, symbol_ids, options.code))
     
     return CallVarCmd(options.is_const, func, args)
 
-@dataclass
+def write_call_var_cmd(cmd: CallVarCmd, out: array[int]):
+    out.append(cmd_word(0x80, cmd.is_const))
+    write_call_args(cmd.func, cmd.args, out)
+
+@dataclass(slots=True)
 class SetCmd:
     is_const: bool
     destination: Var | int
     value: Expr | Var | int
 
-def read_set_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SetCmd:
-    destination_int = next(arr)[1]
+def read_set_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SetCmd:
+    destination_int = next(arr)
     destination = symbol_ids.get(destination_int)
     assert isinstance(destination, Var) or isinstance(destination, int)
     
     if options.is_const:
-        value_int = next(arr)[1]
+        value_int = next(arr)
         value = symbol_ids.get(value_int)
         assert isinstance(value, Var) or isinstance(value, int)
         if value == 0x40:
             value = Expr()
     else:
-        value = read_expr(None, arr, symbol_ids)
+        value = read_expr(None, arr, symbol_ids, options.code)
     
     return SetCmd(options.is_const, destination, value)
 
-@dataclass
+def write_set_cmd(cmd: SetCmd, out: array[int]):
+    out.append(cmd_word(0x3d, cmd.is_const))
+    write_expr_or_var(cmd.destination, out)
+    write_expr_or_var(cmd.value, out)
+
+@dataclass(slots=True)
 class ReadTableLengthCmd:
     is_const: bool
     arrayt: Table
 
-def read_read_table_length_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableLengthCmd:
+def read_read_table_length_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableLengthCmd:
     assert not options.is_const
     
-    arrayt_int = next(arr)[1]
+    arrayt_int = next(arr)
     arrayt = symbol_ids.get(arrayt_int)
     
     return ReadTableLengthCmd(options.is_const, arrayt)
 
+def write_read_table_length_cmd(cmd: ReadTableLengthCmd, out: array[int]):
+    out.append(cmd_word(0x67))
+    write_expr_or_var(cmd.arrayt, out)
+
 # returns the value to FuncVar0 by default (but other variables can be set to whatever it returns directly)
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntryCmd:
     is_const: bool
     arrayt: Table
     index: Expr | Var | int
 
-def read_read_table_entry_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntryCmd:
+def read_read_table_entry_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntryCmd:
     assert not options.is_const
     
-    arrayt_int = next(arr)[1]
+    arrayt_int = next(arr)
     arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
+    index_int = next(arr)
     index = symbol_ids.get(index_int)
     
     return ReadTableEntryCmd(options.is_const, arrayt, index)
 
+def write_read_table_entry_cmd(cmd: ReadTableEntryCmd, out: array[int]):
+    out.append(cmd_word(0x68))
+    write_expr_or_var(cmd.arrayt, out)
+    write_expr_or_var(cmd.index, out)
+
 # this is just like ReadTableEntryCmd, 
 # but the variable that the value returned to is specified in the parameters of this instruction
 # instead of being determined by a SetCmd directly before it
 # so ReadTableEntryToVarCmd and ReadTableEntryCmd are used interchangably
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntryToVarCmd:
     is_const: bool
     arrayt: Table
     index: Expr | Var | int
     var: Var
 
-def read_read_table_entry_to_var_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntryToVarCmd:
+def read_read_table_entry_to_var_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntryToVarCmd:
     assert not options.is_const
     
-    arrayt_int = next(arr)[1]
+    arrayt_int = next(arr)
     arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
+    index_int = next(arr)
     index = symbol_ids.get(index_int)    
-    var_int = next(arr)[1]
+    var_int = next(arr)
     var = symbol_ids.get(var_int)
     assert isinstance(var, Var)
     
     return ReadTableEntryToVarCmd(options.is_const, arrayt, index, var)
 
+def write_read_table_entry_to_var_cmd(cmd: ReadTableEntryToVarCmd, out: array[int]):
+    out.append(cmd_word(0x69))
+    write_expr_or_var(cmd.arrayt, out)
+    write_expr_or_var(cmd.index, out)
+    write_expr_or_var(cmd.var, out)
+
 # read 2 entries starting from the specified index and save those values to 2 specified variables. 
 # Used to read 2d vector values without having to call ReadTableEntry 2 times.
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntriesVec2Cmd:
     is_const: bool
     arrayt: Table
@@ -237,17 +299,17 @@ class ReadTableEntriesVec2Cmd:
     x: Var
     y: Var
 
-def read_read_table_entries_vec2_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntriesVec2Cmd:
+def read_read_table_entries_vec2_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntriesVec2Cmd:
     assert not options.is_const
     
-    arrayt_int = next(arr)[1]
+    arrayt_int = next(arr)
     arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
+    index_int = next(arr)
     index = symbol_ids.get(index_int)    
     
-    x_int = next(arr)[1]
+    x_int = next(arr)
     x = symbol_ids.get(x_int)
-    y_int = next(arr)[1]
+    y_int = next(arr)
     y = symbol_ids.get(y_int)
     
     assert isinstance(x, Var)
@@ -255,9 +317,16 @@ def read_read_table_entries_vec2_cmd(arr: enumerate[int], symbol_ids: SymbolIds,
     
     return ReadTableEntriesVec2Cmd(options.is_const, arrayt, index, x, y)
 
+def write_read_table_entries_vec2_cmd(cmd: ReadTableEntriesVec2Cmd, out: array[int]):
+    out.append(cmd_word(0x6a))
+    write_expr_or_var(cmd.arrayt, out)
+    write_expr_or_var(cmd.index, out)
+    write_expr_or_var(cmd.x, out)
+    write_expr_or_var(cmd.y, out)
+
 # read 3 entries starting from the specified index and save those values to 3 specified variables. 
 # Used to read 3d vector values without having to call ReadTableEntry 3 times.
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntriesVec3Cmd:
     is_const: bool
     arrayt: Table
@@ -266,19 +335,19 @@ class ReadTableEntriesVec3Cmd:
     y: Var
     z: Var
 
-def read_read_table_entries_vec3_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntriesVec3Cmd:
+def read_read_table_entries_vec3_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntriesVec3Cmd:
     assert not options.is_const
     
-    arrayt_int = next(arr)[1]
+    arrayt_int = next(arr)
     arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
+    index_int = next(arr)
     index = symbol_ids.get(index_int)    
     
-    x_int = next(arr)[1]
+    x_int = next(arr)
     x = symbol_ids.get(x_int)
-    y_int = next(arr)[1]
+    y_int = next(arr)
     y = symbol_ids.get(y_int)
-    z_int = next(arr)[1]
+    z_int = next(arr)
     z = symbol_ids.get(z_int)
     
     assert isinstance(x, Var)
@@ -287,31 +356,45 @@ def read_read_table_entries_vec3_cmd(arr: enumerate[int], symbol_ids: SymbolIds,
     
     return ReadTableEntriesVec3Cmd(options.is_const, arrayt, index, x, y, z)
 
-@dataclass
+def write_read_table_entries_vec3_cmd(cmd: ReadTableEntriesVec3Cmd, out: array[int]):
+    out.append(cmd_word(0x6b))
+    write_expr_or_var(cmd.arrayt, out)
+    write_expr_or_var(cmd.index, out)
+    write_expr_or_var(cmd.x, out)
+    write_expr_or_var(cmd.y, out)
+    write_expr_or_var(cmd.z, out)
+
+@dataclass(slots=True)
 class TableGetIndexCmd:
     is_const: bool
     arrayt: Table
     occurance: Expr | Var | int
     var: Var
 
-def read_table_get_index_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> TableGetIndexCmd:
+def read_table_get_index_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> TableGetIndexCmd:
     assert not options.is_const
     
-    arrayt_int = next(arr)[1]
+    arrayt_int = next(arr)
     arrayt = symbol_ids.get(arrayt_int)
-    occurance_int = next(arr)[1]
+    occurance_int = next(arr)
     occurance = symbol_ids.get(occurance_int)    
-    var_int = next(arr)[1]
+    var_int = next(arr)
     var = symbol_ids.get(var_int)
     assert isinstance(var, Var)
     
     return TableGetIndexCmd(options.is_const, arrayt, occurance, var)
 
-@dataclass
+def write_table_get_index_cmd(cmd: TableGetIndexCmd, out: array[int]):
+    out.append(cmd_word(0x6d))
+    write_expr_or_var(cmd.arrayt, out)
+    write_expr_or_var(cmd.occurance, out)
+    write_expr_or_var(cmd.var, out)
+
+@dataclass(slots=True)
 class ReturnCmd:
     pass
 
-def read_return_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReturnCmd:
+def read_return_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReturnCmd:
     assert not options.is_const
     
     # A new layer gets pushed to in child threads (Thread and Thread2) for captured vars
@@ -321,22 +404,22 @@ def read_return_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmd
     return ReturnCmd()
 
 def write_return_cmd(cmd: ReturnCmd, out: array[int]):
-    pass
+    out.append(cmd_word(0x9))
     
-@dataclass
+@dataclass(slots=True)
 class GetArgsCmd:
     func: 'functions.FunctionDef'
     args: list[Var | int]
 
-def read_get_args_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GetArgsCmd:
+def read_get_args_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GetArgsCmd:
     assert not options.is_const
     
-    func_int = next(arr)[1]
+    func_int = next(arr)
     func = symbol_ids.get(func_int)
     assert isinstance(func, functions.FunctionDef)
     
     args = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x8:
             break
         
@@ -347,6 +430,7 @@ def read_get_args_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadC
     return GetArgsCmd(func, args)
 
 def write_get_args_cmd(cmd: GetArgsCmd, out: array[int]):
+    out.append(cmd_word(0x5))
     out.append(cmd.func.id)
     
     for arg in cmd.args:
@@ -354,60 +438,67 @@ def write_get_args_cmd(cmd: GetArgsCmd, out: array[int]):
     
     out.append(0x8)
 
-@dataclass
+@dataclass(slots=True)
 class IfCmd:
     condition: Expr
     unused1: int
     jump_to: int
     unused2: int
 
-def read_if_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfCmd:
+def read_if_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfCmd:
     assert not options.is_const
     
-    condition = read_expr(None, arr, symbol_ids)
-    unused1 = next(arr)[1]
-    jump_to = next(arr)[1]
-    unused2 = next(arr)[1]
+    condition = read_expr(None, arr, symbol_ids, options.code)
+    unused1 = next(arr)
+    jump_to = next(arr)
+    unused2 = next(arr)
     
     return IfCmd(condition, unused1, jump_to, unused2)
 
+def write_if_cmd(cmd: IfCmd, out: array[int]):
+    out.append(cmd_word(0x18))
+    write_expr_or_var(cmd.condition, out)
+    out.append(cmd.unused1)
+    out.append(cmd.jump_to)
+    out.append(cmd.unused2)
+
 # these appear in Script/Map/MAC/mac_1_30.bin
 # TODO: Find other use cases to confirm whether these are what they appear to be.
-@dataclass
+@dataclass(slots=True)
 class IfEqualCmd:
     var1: Expr | Var | int
     var2: Expr | Var | int
     jump_to: int # TODO: ensure that jump_to always points to an Else, ElseIf or EndIf
 
-def read_ifequal_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfEqualCmd:
+def read_ifequal_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfEqualCmd:
     assert not options.is_const
     
-    var1_int = next(arr)[1]
+    var1_int = next(arr)
     var1 = symbol_ids.get(var1_int)
-    var2_int = next(arr)[1]
+    var2_int = next(arr)
     var2 = symbol_ids.get(var2_int)
-    jump_to = next(arr)[1]
+    jump_to = next(arr)
     
     return IfEqualCmd(var1, var2, jump_to)
 
-@dataclass
+@dataclass(slots=True)
 class IfNotEqualCmd:
     var1: Expr | Var | int
     var2: Expr | Var | int
     jump_to: int
 
-def read_ifnotequal_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfNotEqualCmd:
+def read_ifnotequal_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfNotEqualCmd:
     assert not options.is_const
     
-    var1_int = next(arr)[1]
+    var1_int = next(arr)
     var1 = symbol_ids.get(var1_int)
-    var2_int = next(arr)[1]
+    var2_int = next(arr)
     var2 = symbol_ids.get(var2_int)
-    jump_to = next(arr)[1]
+    jump_to = next(arr)
     
     return IfNotEqualCmd(var1, var2, jump_to)
 
-@dataclass
+@dataclass(slots=True)
 class ElseIfCmd:
     start_from: int
     unused1: int
@@ -416,93 +507,136 @@ class ElseIfCmd:
     jump_to: int
     unused3: int
 
-def read_else_if_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ElseIfCmd:
+def read_else_if_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ElseIfCmd:
     assert not options.is_const
     
-    start_from = next(arr)[1]
-    unused1 = next(arr)[1]
-    condition = read_expr(None, arr, symbol_ids)
-    unused2 = next(arr)[1]
-    jump_to = next(arr)[1]
-    unused3 = next(arr)[1]
+    start_from = next(arr)
+    unused1 = next(arr)
+    condition = read_expr(None, arr, symbol_ids, options.code)
+    unused2 = next(arr)
+    jump_to = next(arr)
+    unused3 = next(arr)
     
     return ElseIfCmd(start_from, unused1, condition, unused2, jump_to, unused3)
 
-@dataclass
+def write_else_if_cmd(cmd: ElseIfCmd, out: array[int]):
+    out.append(cmd_word(0x27))
+    out.append(cmd.start_from)
+    out.append(cmd.unused1)
+    write_expr_or_var(cmd.condition, out)
+    out.append(cmd.unused2)
+    out.append(cmd.jump_to)
+    out.append(cmd.unused3)
+
+@dataclass(slots=True)
 class ElseCmd:
     jump_to: int
 
-def read_else_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ElseCmd:
+def read_else_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ElseCmd:
     assert not options.is_const
     
-    jump_to = next(arr)[1]
+    jump_to = next(arr)
     
     return ElseCmd(jump_to)
 
-@dataclass
+def write_else_cmd(cmd: ElseCmd, out: array[int]):
+    out.append(cmd_word(0x26))
+    out.append(cmd.jump_to)
+
+@dataclass(slots=True)
 class GotoLabelCmd:
     label: Label | int
 
-def read_goto_label_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GotoLabelCmd:
+def read_goto_label_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GotoLabelCmd:
     assert not options.is_const
     
-    label_int = next(arr)[1]
+    label_int = next(arr)
     label = symbol_ids.get(label_int)
     assert isinstance(label, Label) or isinstance(label, int)
     
     return GotoLabelCmd(label)
 
-@dataclass
+def write_goto_label_cmd(cmd: GotoLabelCmd, out: array[int]):
+    out.append(cmd_word(0xa))
+    write_expr_or_var(cmd.label, out)
+
+@dataclass(slots=True)
 class NoopCmd:
     opcode: int
 
-def read_noop_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> NoopCmd:
+def read_noop_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> NoopCmd:
     assert not options.is_const
     
     return NoopCmd(options.opcode)
 
-@dataclass
+def write_noop_cmd(cmd: NoopCmd, out: array[int]):
+    out.append(cmd_word(cmd.opcode))
+
+@dataclass(slots=True)
 class LabelCmd:
     offset: int
     label: Label | None
 
-def read_label_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> LabelCmd:
+def read_label_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> LabelCmd:
     assert not options.is_const
     assert options.cmd_offset is not None
     
     return LabelCmd(options.cmd_offset, None)
 
-@dataclass
+def write_label_cmd(cmd: LabelCmd, out: array[int]):
+    out.append(cmd_word(0x4))
+
+@dataclass(slots=True)
 class EndIfCmd:
     pass
 
-def read_endif_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndIfCmd:
+def read_endif_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndIfCmd:
     assert not options.is_const
     
     return EndIfCmd()
 
-@dataclass
+def write_endif_cmd(cmd: EndIfCmd, out: array[int]):
+    out.append(cmd_word(0x28))
+
+def push_thread_captures(symbol_ids: SymbolIds, take_args: list[int], give_args: list[Var | int], outer_temp_vars: bool):
+    # Thread and Thread2 are always ended by a Return
+    # this will make sure the thread body has access to the captured vars
+    # and that they won't leak out of this thread
+    symbol_ids.push()
+    
+    assert len(give_args) == len(take_args)
+    for give, take in zip(give_args, take_args):
+        if not isinstance(give, Var):
+            continue
+        
+        copy = replace(give)
+        copy.id = take
+        if outer_temp_vars and copy.category == VarCategory.TempVar:
+            copy.category = VarCategory.OuterTempVar
+        symbol_ids.add(copy)
+
+@dataclass(slots=True)
 class ThreadCmd:
     func: 'functions.FunctionDef | ScriptImport | int'
     take_args: list[int]
     give_args: list[Var | int]
 
-def read_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ThreadCmd:
+def read_thread_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ThreadCmd:
     assert not options.is_const
     
-    func_int = next(arr)[1]
+    func_int = next(arr)
     func = symbol_ids.get(func_int)
     assert isinstance(func, functions.FunctionDef)
     
     take_args: list[int] = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x8:
             break
         
         take_args.append(value)
     
     give_args: list[Var | int] = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x11:
             break
         
@@ -510,46 +644,47 @@ def read_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmd
         assert isinstance(var, Var) or isinstance(var, int)
         give_args.append(var)
     
-    # Thread and Thread2 are always ended by a Return
-    # this will make sure the thread body has access to the captured vars
-    # and that they won't leak out of this thread
-    symbol_ids.push()
-    
-    assert len(give_args) == len(take_args)
-    for give, take in zip(give_args, take_args):
-        if not isinstance(give, Var):
-            continue
-        
-        copy = replace(give)
-        copy.id = take
-        if copy.category == VarCategory.TempVar:
-            copy.category = VarCategory.OuterTempVar
-        symbol_ids.add(copy)
+    push_thread_captures(symbol_ids, take_args, give_args, True)
         
     return ThreadCmd(func, take_args, give_args)
 
-@dataclass
+def write_thread_args(func: 'functions.FunctionDef | ScriptImport | int', take_args: list[int], give_args: list[Var | int], out: array[int]):
+    # shared by Thread and Thread2
+    out.append(func if isinstance(func, int) else func.id)
+    out.extend(take_args)
+    out.append(0x8)
+    
+    for var in give_args:
+        write_expr_or_var(var, out)
+    
+    out.append(0x11)
+
+def write_thread_cmd(cmd: ThreadCmd, out: array[int]):
+    out.append(cmd_word(0x6))
+    write_thread_args(cmd.func, cmd.take_args, cmd.give_args, out)
+
+@dataclass(slots=True)
 class Thread2Cmd:
     func: 'functions.FunctionDef | ScriptImport | int'
     take_args: list[int]
     give_args: list[Var | int]
 
-def read_thread2_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> Thread2Cmd:
+def read_thread2_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> Thread2Cmd:
     assert not options.is_const
     
-    func_int = next(arr)[1]
+    func_int = next(arr)
     func = symbol_ids.get(func_int)
     assert isinstance(func, functions.FunctionDef)
     
     take_args: list[int] = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x8:
             break
         
         take_args.append(value)
         
     give_args: list[Var | int] = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x11:
             break
         
@@ -557,308 +692,381 @@ def read_thread2_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCm
         assert isinstance(var, Var) or isinstance(var, int)
         give_args.append(var)
     
-    # Thread and Thread2 are always ended by a Return
-    # this will make sure the thread body has access to the captured vars
-    # and that they won't leak out of this thread
-    symbol_ids.push()
-    
-    assert len(give_args) == len(take_args)
-    for give, take in zip(give_args, take_args):
-        if not isinstance(give, Var):
-            continue
-        
-        copy = replace(give)
-        copy.id = take
-        symbol_ids.add(copy)
+    push_thread_captures(symbol_ids, take_args, give_args, False)
     
     return Thread2Cmd(func, take_args, give_args)
 
-@dataclass
+def write_thread2_cmd(cmd: Thread2Cmd, out: array[int]):
+    out.append(cmd_word(0x7))
+    write_thread_args(cmd.func, cmd.take_args, cmd.give_args, out)
+
+@dataclass(slots=True)
 class DeleteRuntimeCmd:
     is_const: bool
     var: Expr | Var | int
 
-def read_delete_runtime_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> DeleteRuntimeCmd:
-    var_int = next(arr)[1]
+def read_delete_runtime_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> DeleteRuntimeCmd:
+    var_int = next(arr)
     var = symbol_ids.get(var_int)
     if options.is_const:
         assert isinstance(var, Var) or isinstance(var, int)
     
     return DeleteRuntimeCmd(options.is_const, var)
 
-@dataclass
+def write_delete_runtime_cmd(cmd: DeleteRuntimeCmd, out: array[int]):
+    out.append(cmd_word(0x12, cmd.is_const))
+    write_expr_or_var(cmd.var, out)
+
+@dataclass(slots=True)
 class WaitCmd:
     is_const: bool
     duration: Expr | Var | int
 
-def read_wait_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitCmd:
+def read_wait_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitCmd:
     if options.is_const:
-        duration_int = next(arr)[1]
+        duration_int = next(arr)
         duration = symbol_ids.get(duration_int)
         assert isinstance(duration, Var) or isinstance(duration, int)
     else:
-        duration = read_expr(None, arr, symbol_ids)
+        duration = read_expr(None, arr, symbol_ids, options.code)
     
     return WaitCmd(options.is_const, duration)
 
-@dataclass
+def write_wait_cmd(cmd: WaitCmd, out: array[int]):
+    out.append(cmd_word(0x16, cmd.is_const))
+    write_expr_or_var(cmd.duration, out)
+
+@dataclass(slots=True)
 class WaitMsCmd:
     is_const: bool
     duration: Expr | Var | int
 
-def read_wait_ms_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitMsCmd:
+def read_wait_ms_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitMsCmd:
     if options.is_const:
-        duration_int = next(arr)[1]
+        duration_int = next(arr)
         duration = symbol_ids.get(duration_int)
         assert isinstance(duration, Var) or isinstance(duration, int)
     else:
-        duration = read_expr(None, arr, symbol_ids)
+        duration = read_expr(None, arr, symbol_ids, options.code)
     
     return WaitMsCmd(options.is_const, duration)
 
-@dataclass
+def write_wait_ms_cmd(cmd: WaitMsCmd, out: array[int]):
+    out.append(cmd_word(0x17, cmd.is_const))
+    write_expr_or_var(cmd.duration, out)
+
+@dataclass(slots=True)
 class SwitchCmd:
     var: Var | int
     unused: int
     jump_offset: int
 
-def read_switch_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SwitchCmd:
+def read_switch_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SwitchCmd:
     assert not options.is_const
 
-    var_int = next(arr)[1]
+    var_int = next(arr)
     var = symbol_ids.get(var_int)
     assert isinstance(var, Var) or isinstance(var, int)
     
-    unused = next(arr)[1]
-    jump_offset = next(arr)[1]
+    unused = next(arr)
+    jump_offset = next(arr)
     
     return SwitchCmd(var, unused, jump_offset)
 
-@dataclass
+def write_switch_cmd(cmd: SwitchCmd, out: array[int]):
+    out.append(cmd_word(0x29))
+    write_expr_or_var(cmd.var, out)
+    out.append(cmd.unused)
+    out.append(cmd.jump_offset)
+
+@dataclass(slots=True)
 class CaseEqCmd:
     is_const: bool
     value: Expr | Var | int
     jump_offset: int
 
-def read_case_eq_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseEqCmd:
-    value_int = next(arr)[1]
+def read_case_eq_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseEqCmd:
+    value_int = next(arr)
     if options.is_const:
         value = symbol_ids.get(value_int)
         assert isinstance(value, Var) or isinstance(value, int)
     else:
         value = symbol_ids.get(value_int)
     
-    jump_offset = next(arr)[1]
+    jump_offset = next(arr)
     
     return CaseEqCmd(options.is_const, value, jump_offset)
 
+def write_case_eq_cmd(cmd: CaseEqCmd, out: array[int]):
+    out.append(cmd_word(0x2a, cmd.is_const))
+    write_expr_or_var(cmd.value, out)
+    out.append(cmd.jump_offset)
+
 # A variant of the switch instruction that seems to also take two floating point values...
 # It being a check as to whether the match value is within this range is just a guess.
-@dataclass
+@dataclass(slots=True)
 class CaseRangeCmd:
     is_const: bool
     lower: Expr | Var | int
     upper: Expr | Var | int
     jump_offset: int
 
-def read_case_range_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseRangeCmd:
-    lower_int = next(arr)[1]
+def read_case_range_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseRangeCmd:
+    lower_int = next(arr)
     if options.is_const:
         lower = symbol_ids.get(lower_int)
         assert isinstance(lower, Var) or isinstance(lower, int)
     else:
         lower = symbol_ids.get(lower_int)
         
-    upper_int = next(arr)[1]
+    upper_int = next(arr)
     if options.is_const:
         upper = symbol_ids.get(upper_int)
         assert isinstance(upper, Var) or isinstance(upper, int)
     else:
         upper = symbol_ids.get(upper_int)
     
-    jump_offset = next(arr)[1]
+    jump_offset = next(arr)
     
     return CaseRangeCmd(options.is_const, lower, upper, jump_offset)
 
-@dataclass
+def write_case_range_cmd(cmd: CaseRangeCmd, out: array[int]):
+    out.append(cmd_word(0x30, cmd.is_const))
+    write_expr_or_var(cmd.lower, out)
+    write_expr_or_var(cmd.upper, out)
+    out.append(cmd.jump_offset)
+
+@dataclass(slots=True)
 class BreakSwitchCmd:
     pass
 
-def read_breakswitch_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> BreakSwitchCmd:
+def read_breakswitch_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> BreakSwitchCmd:
     assert not options.is_const
     
     return BreakSwitchCmd()
 
-@dataclass
+def write_breakswitch_cmd(cmd: BreakSwitchCmd, out: array[int]):
+    out.append(cmd_word(0x37))
+
+@dataclass(slots=True)
 class EndSwitchCmd:
     pass
 
-def read_endswitch_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndSwitchCmd:
+def read_endswitch_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndSwitchCmd:
     assert not options.is_const
     
     return EndSwitchCmd()
 
-@dataclass
+def write_endswitch_cmd(cmd: EndSwitchCmd, out: array[int]):
+    out.append(cmd_word(0x38))
+
+@dataclass(slots=True)
 class WhileCmd:
     is_const: bool
     value: Expr | Var | int
     jump_offset: int
 
-def read_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WhileCmd:
+def read_while_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WhileCmd:
     if options.is_const:
-        value_int = next(arr)[1]
+        value_int = next(arr)
         value = symbol_ids.get(value_int)
         assert isinstance(value, Var) or isinstance(value, int)
     else:
-        value = read_expr(None, arr, symbol_ids)
+        value = read_expr(None, arr, symbol_ids, options.code)
     
-    jump_offset = next(arr)[1]
+    jump_offset = next(arr)
     
     return WhileCmd(options.is_const, value, jump_offset)
 
-@dataclass
+def write_while_cmd(cmd: WhileCmd, out: array[int]):
+    out.append(cmd_word(0x39, cmd.is_const))
+    write_expr_or_var(cmd.value, out)
+    out.append(cmd.jump_offset)
+
+@dataclass(slots=True)
 class BreakCmd:
     pass
 
-def read_break_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> BreakCmd:
+def read_break_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> BreakCmd:
     assert not options.is_const
     
     return BreakCmd()
 
-@dataclass
+def write_break_cmd(cmd: BreakCmd, out: array[int]):
+    out.append(cmd_word(0x3a))
+
+@dataclass(slots=True)
 class EndWhileCmd:
     pass
 
-def read_end_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndWhileCmd:
+def read_end_while_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndWhileCmd:
     assert not options.is_const
     
     return EndWhileCmd()
 
-@dataclass
+def write_end_while_cmd(cmd: EndWhileCmd, out: array[int]):
+    out.append(cmd_word(0x3c))
+
+@dataclass(slots=True)
 class WaitCompletedCmd:
     is_const: bool
     runtime: Expr | Var | int
 
-def read_wait_completed_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitCompletedCmd:
+def read_wait_completed_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitCompletedCmd:
     if options.is_const:
-        runtime_int = next(arr)[1]
+        runtime_int = next(arr)
         runtime = symbol_ids.get(runtime_int)
         assert isinstance(runtime, Var) or isinstance(runtime, int)
     else:
-        runtime = read_expr(None, arr, symbol_ids)
+        runtime = read_expr(None, arr, symbol_ids, options.code)
     
     return WaitCompletedCmd(options.is_const, runtime)
 
-@dataclass
+def write_wait_completed_cmd(cmd: WaitCompletedCmd, out: array[int]):
+    out.append(cmd_word(0x89, cmd.is_const))
+    write_expr_or_var(cmd.runtime, out)
+
+@dataclass(slots=True)
 class WaitWhileCmd:
     condition: Expr
     unused1: int
     unused2: int
 
-def read_wait_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitWhileCmd:
+def read_wait_while_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitWhileCmd:
     assert not options.is_const
     
-    condition = read_expr(None, arr, symbol_ids)
-    unused1 = next(arr)[1]
-    unused2 = next(arr)[1]
+    condition = read_expr(None, arr, symbol_ids, options.code)
+    unused1 = next(arr)
+    unused2 = next(arr)
     
     return WaitWhileCmd(condition, unused1, unused2)
 
-@dataclass
+def write_wait_while_cmd(cmd: WaitWhileCmd, out: array[int]):
+    out.append(cmd_word(0x9f))
+    write_expr_or_var(cmd.condition, out)
+    out.append(cmd.unused1)
+    out.append(cmd.unused2)
+
+@dataclass(slots=True)
 class ToIntCmd:
     variable: Var | int
 
-def read_to_int_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ToIntCmd:
+def read_to_int_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ToIntCmd:
     assert not options.is_const
     
-    var_int = next(arr)[1]
+    var_int = next(arr)
     var = symbol_ids.get(var_int)
     
     return ToIntCmd(var)
 
-@dataclass
+def write_to_int_cmd(cmd: ToIntCmd, out: array[int]):
+    out.append(cmd_word(0x85))
+    write_expr_or_var(cmd.variable, out)
+
+@dataclass(slots=True)
 class ToFloatCmd:
     variable: Var | int
 
-def read_to_float_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ToFloatCmd:
+def read_to_float_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ToFloatCmd:
     assert not options.is_const
     
-    var_int = next(arr)[1]
+    var_int = next(arr)
     var = symbol_ids.get(var_int)
     
     return ToFloatCmd(var)
 
-@dataclass
+def write_to_float_cmd(cmd: ToFloatCmd, out: array[int]):
+    out.append(cmd_word(0x86))
+    write_expr_or_var(cmd.variable, out)
+
+@dataclass(slots=True)
 class LoadKSMCmd:
     variable: Var | int
 
-def read_load_ksm_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> LoadKSMCmd:
+def read_load_ksm_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> LoadKSMCmd:
     assert not options.is_const
     
-    var_int = next(arr)[1]
+    var_int = next(arr)
     var = symbol_ids.get(var_int)
     
     return LoadKSMCmd(var)
 
-@dataclass
+def write_load_ksm_cmd(cmd: LoadKSMCmd, out: array[int]):
+    out.append(cmd_word(0x75))
+    write_expr_or_var(cmd.variable, out)
+
+@dataclass(slots=True)
 class GetArgCountCmd:
     pass
 
-def read_get_arg_count_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GetArgCountCmd:
+def read_get_arg_count_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GetArgCountCmd:
     assert not options.is_const
     
     return GetArgCountCmd()
 
-@dataclass
+def write_get_arg_count_cmd(cmd: GetArgCountCmd, out: array[int]):
+    out.append(cmd_word(0x77))
+
+@dataclass(slots=True)
 class CaseLteCmd:
     is_const: bool
     value: Expr | Var | int
     jump_offset: int
 
-def read_case_lte_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseLteCmd:
+def read_case_lte_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseLteCmd:
     
-    value_int = next(arr)[1]
+    value_int = next(arr)
     if options.is_const:
         value = symbol_ids.get(value_int)
         assert isinstance(value, Var) or isinstance(value, int)
     else:
         value = symbol_ids.get(value_int)
     
-    jump_offset = next(arr)[1]
+    jump_offset = next(arr)
     
     return CaseLteCmd(options.is_const, value, jump_offset)
 
-@dataclass
+def write_case_lte_cmd(cmd: CaseLteCmd, out: array[int]):
+    out.append(cmd_word(0x2f, cmd.is_const))
+    write_expr_or_var(cmd.value, out)
+    out.append(cmd.jump_offset)
+
+@dataclass(slots=True)
 class SetKSMUnkCmd:
     is_const: bool
     runtime: Var | int
     value: Expr | Var | int
 
-def read_set_ksm_unk_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SetKSMUnkCmd:
-    runtime_int = next(arr)[1]
+def read_set_ksm_unk_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SetKSMUnkCmd:
+    runtime_int = next(arr)
     runtime = symbol_ids.get(runtime_int)
     assert isinstance(runtime, Var) or isinstance(runtime, int)
     
     if options.is_const:
-        value_int = next(arr)[1]
+        value_int = next(arr)
         value = symbol_ids.get(value_int)
         assert isinstance(value, Var) or isinstance(value, int)
         if value == 0x40:
             value = Expr()
     else:
-        value = read_expr(None, arr, symbol_ids)
+        value = read_expr(None, arr, symbol_ids, options.code)
     
     return SetKSMUnkCmd(options.is_const, runtime, value)
 
-@dataclass
+def write_set_ksm_unk_cmd(cmd: SetKSMUnkCmd, out: array[int]):
+    out.append(cmd_word(0x76, cmd.is_const))
+    write_expr_or_var(cmd.runtime, out)
+    write_expr_or_var(cmd.value, out)
+
+@dataclass(slots=True)
 class UnknownCmd:
     opcode: int
     is_const: bool
     args: list[Expr | Var | int]
 
-def read_unknown_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> UnknownCmd:
+def read_unknown_cmd(arr: Iterator[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> UnknownCmd:
     args = []
-    for _, value in arr:
+    for value in arr:
         if value == 0x11:
             break
         
@@ -870,141 +1078,367 @@ def read_unknown_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCm
     
     return UnknownCmd(options.opcode, options.is_const, args)
 
+def write_unknown_cmd(cmd: UnknownCmd, out: array[int]):
+    out.append(cmd_word(cmd.opcode, cmd.is_const))
+    
+    for arg in cmd.args:
+        match arg:
+            case ExprSymbol(opcode=opcode):
+                out.append(opcode)
+            case _:
+                write_expr_or_var(arg, out)
+    
+    out.append(0x11)
+
+# the instructions that continue or close a block, by the instruction that closes it
+BLOCK_CLOSED_BY: dict[type, type] = {
+    ElseIfCmd: EndIfCmd, ElseCmd: EndIfCmd, EndIfCmd: EndIfCmd,
+    CaseEqCmd: EndSwitchCmd, CaseLteCmd: EndSwitchCmd, CaseRangeCmd: EndSwitchCmd, EndSwitchCmd: EndSwitchCmd,
+    EndWhileCmd: EndWhileCmd,
+}
+
+BLOCK_CMDS = {IfCmd, SwitchCmd, WhileCmd, *BLOCK_CLOSED_BY}
+
 # command registry
 def register_cmds():
     instructions = InstructionRegistry()
     
-    def add_cmd[T](opcode: int, cls: type[T] | None = None, read_func: ReadCmdFunc | None = None, write_func: WriteCmdFunc[T] | None = None):
+    def add_cmd[T](opcode: int, cls: type[T] | None = None, read_func: ReadCmdFunc | None = None, write_func: WriteCmdFunc[T] | None = None,
+                   needs_offset: bool = False):
         if read_func is not None:
+            assert opcode < CONST_BIT
             instructions.readers[opcode] = read_func
+            
+            for is_const in (False, True):
+                options = ReadCmdOptions(opcode, is_const)
+                instructions.dispatch[opcode | (CONST_BIT if is_const else 0)] = (read_func, options, needs_offset, cls in BLOCK_CMDS)
         
         if write_func is not None:
             assert cls is not None
             instructions.writers[cls] = write_func
 
     # TODO: some of the noops return 1, some 3, might be worth looking into
-    add_cmd(0x2, read_func=read_noop_cmd)
-    add_cmd(0x3, read_func=read_returnval_cmd)
-    add_cmd(0x4, read_func=read_label_cmd)
+    add_cmd(0x2, NoopCmd, read_noop_cmd, write_noop_cmd)
+    add_cmd(0x3, ReturnValCmd, read_returnval_cmd, write_returnval_cmd)
+    add_cmd(0x4, LabelCmd, read_label_cmd, write_label_cmd, needs_offset=True)
     
     add_cmd(0x5, GetArgsCmd, read_get_args_cmd, write_get_args_cmd)
     
-    add_cmd(0x6, read_func=read_thread_cmd)
-    add_cmd(0x7, read_func=read_thread2_cmd)
+    add_cmd(0x6, ThreadCmd, read_thread_cmd, write_thread_cmd)
+    add_cmd(0x7, Thread2Cmd, read_thread2_cmd, write_thread2_cmd)
     
     add_cmd(0x9, ReturnCmd, read_return_cmd, write_return_cmd)
     
-    add_cmd(0xa, read_func=read_goto_label_cmd)
+    add_cmd(0xa, GotoLabelCmd, read_goto_label_cmd, write_goto_label_cmd)
     
     add_cmd(0xc, CallCmd, read_call_cmd, write_call_cmd)
     
-    add_cmd(0xd, read_func=read_call_as_thread_cmd)
-    add_cmd(0xe, read_func=read_call_as_child_thread_cmd)
-    add_cmd(0x12, read_func=read_delete_runtime_cmd)
-    add_cmd(0x16, read_func=read_wait_cmd)
-    add_cmd(0x17, read_func=read_wait_ms_cmd)
-    add_cmd(0x18, read_func=read_if_cmd)
+    add_cmd(0xd, CallAsThreadCmd, read_call_as_thread_cmd, write_call_as_thread_cmd)
+    add_cmd(0xe, CallAsChildThreadCmd, read_call_as_child_thread_cmd, write_call_as_child_thread_cmd)
+    add_cmd(0x12, DeleteRuntimeCmd, read_delete_runtime_cmd, write_delete_runtime_cmd)
+    add_cmd(0x16, WaitCmd, read_wait_cmd, write_wait_cmd)
+    add_cmd(0x17, WaitMsCmd, read_wait_ms_cmd, write_wait_ms_cmd)
+    add_cmd(0x18, IfCmd, read_if_cmd, write_if_cmd)
         
     # Unusual If Instructions (experimental)
     # add_cmd(0x19, read_ifequal_cmd)
     # add_cmd(0x1d, read_ifnotequal_cmd)
         
     # Switch, Case Instructions
-    add_cmd(0x26, read_func=read_else_cmd)
-    add_cmd(0x27, read_func=read_else_if_cmd)
-    add_cmd(0x28, read_func=read_endif_cmd)
-    add_cmd(0x29, read_func=read_switch_cmd)
-    add_cmd(0x2a, read_func=read_case_eq_cmd)
-    add_cmd(0x2f, read_func=read_case_lte_cmd)
-    add_cmd(0x30, read_func=read_case_range_cmd)
-    add_cmd(0x37, read_func=read_breakswitch_cmd)
-    add_cmd(0x38, read_func=read_endswitch_cmd)
+    add_cmd(0x26, ElseCmd, read_else_cmd, write_else_cmd)
+    add_cmd(0x27, ElseIfCmd, read_else_if_cmd, write_else_if_cmd)
+    add_cmd(0x28, EndIfCmd, read_endif_cmd, write_endif_cmd)
+    add_cmd(0x29, SwitchCmd, read_switch_cmd, write_switch_cmd)
+    add_cmd(0x2a, CaseEqCmd, read_case_eq_cmd, write_case_eq_cmd)
+    add_cmd(0x2f, CaseLteCmd, read_case_lte_cmd, write_case_lte_cmd)
+    add_cmd(0x30, CaseRangeCmd, read_case_range_cmd, write_case_range_cmd)
+    add_cmd(0x37, BreakSwitchCmd, read_breakswitch_cmd, write_breakswitch_cmd)
+    add_cmd(0x38, EndSwitchCmd, read_endswitch_cmd, write_endswitch_cmd)
         
     # While Instructions
-    add_cmd(0x39, read_func=read_while_cmd)
-    add_cmd(0x3a, read_func=read_break_cmd)
-    add_cmd(0x3c, read_func=read_end_while_cmd)
+    add_cmd(0x39, WhileCmd, read_while_cmd, write_while_cmd)
+    add_cmd(0x3a, BreakCmd, read_break_cmd, write_break_cmd)
+    add_cmd(0x3c, EndWhileCmd, read_end_while_cmd, write_end_while_cmd)
         
-    add_cmd(0x3d, read_func=read_set_cmd)
+    add_cmd(0x3d, SetCmd, read_set_cmd, write_set_cmd)
         
     # Array Instructions 
-    add_cmd(0x67, read_func=read_read_table_length_cmd)
-    add_cmd(0x68, read_func=read_read_table_entry_cmd)
-    add_cmd(0x69, read_func=read_read_table_entry_to_var_cmd)
-    add_cmd(0x6a, read_func=read_read_table_entries_vec2_cmd)
-    add_cmd(0x6b, read_func=read_read_table_entries_vec3_cmd)
-    add_cmd(0x6d, read_func=read_table_get_index_cmd)
-    
-    add_cmd(0x6e, read_func=read_noop_cmd)
-    add_cmd(0x6f, read_func=read_noop_cmd)
+    add_cmd(0x67, ReadTableLengthCmd, read_read_table_length_cmd, write_read_table_length_cmd)
+    add_cmd(0x68, ReadTableEntryCmd, read_read_table_entry_cmd, write_read_table_entry_cmd)
+    add_cmd(0x69, ReadTableEntryToVarCmd, read_read_table_entry_to_var_cmd, write_read_table_entry_to_var_cmd)
+    add_cmd(0x6a, ReadTableEntriesVec2Cmd, read_read_table_entries_vec2_cmd, write_read_table_entries_vec2_cmd)
+    add_cmd(0x6b, ReadTableEntriesVec3Cmd, read_read_table_entries_vec3_cmd, write_read_table_entries_vec3_cmd)
+    add_cmd(0x6d, TableGetIndexCmd, read_table_get_index_cmd, write_table_get_index_cmd)
+    
+    add_cmd(0x6e, NoopCmd, read_noop_cmd, write_noop_cmd)
+    add_cmd(0x6f, NoopCmd, read_noop_cmd, write_noop_cmd)
         
-    add_cmd(0x75, read_func=read_load_ksm_cmd)
-    add_cmd(0x76, read_func=read_set_ksm_unk_cmd)
-    add_cmd(0x77, read_func=read_get_arg_count_cmd)
+    add_cmd(0x75, LoadKSMCmd, read_load_ksm_cmd, write_load_ksm_cmd)
+    add_cmd(0x76, SetKSMUnkCmd, read_set_ksm_unk_cmd, write_set_ksm_unk_cmd)
+    add_cmd(0x77, GetArgCountCmd, read_get_arg_count_cmd, write_get_arg_count_cmd)
         
     # TODO: are these noops?
-    add_cmd(0x7c, read_func=read_noop_cmd)
-    add_cmd(0x7d, read_func=read_noop_cmd)
+    add_cmd(0x7c, NoopCmd, read_noop_cmd, write_noop_cmd)
+    add_cmd(0x7d, NoopCmd, read_noop_cmd, write_noop_cmd)
         
-    add_cmd(0x80, read_func=read_call_var_cmd)
+    add_cmd(0x80, CallVarCmd, read_call_var_cmd, write_call_var_cmd)
     # add_cmd(0x81, read_func=read_call_var_as_thread)
     # add_cmd(0x82, read_func=read_call_var_as_child_thread)
-    add_cmd(0x85, read_func=read_to_int_cmd)
-    add_cmd(0x86, read_func=read_to_float_cmd)
-    add_cmd(0x89, read_func=read_wait_completed_cmd)
-    add_cmd(0x9f, read_func=read_wait_while_cmd)
+    add_cmd(0x85, ToIntCmd, read_to_int_cmd, write_to_int_cmd)
+    add_cmd(0x86, ToFloatCmd, read_to_float_cmd, write_to_float_cmd)
+    add_cmd(0x89, WaitCompletedCmd, read_wait_completed_cmd, write_wait_completed_cmd)
+    add_cmd(0x9f, WaitWhileCmd, read_wait_while_cmd, write_wait_while_cmd)
+    
+    # unknown instructions aren't in the dispatch table, but can be written back like any other
+    instructions.writers[UnknownCmd] = write_unknown_cmd
     
     return instructions
 
 INSTRUCTIONS = register_cmds()
 
 # text syntax
-def cmd_from_string(code: str, current_func: functions.FunctionDef, constants: list[Var], symbol_ids: SymbolIds) -> Any:
+# instructions that take a fixed list of single values in parentheses
+TABLE_CMDS: dict[str, type] = {
+    'ReadTableLength': ReadTableLengthCmd,
+    'ReadTableEntry': ReadTableEntryCmd,
+    'ReadTableEntryToVar': ReadTableEntryToVarCmd,
+    'ReadTableEntriesVec2': ReadTableEntriesVec2Cmd,
+    'ReadTableEntriesVec3': ReadTableEntriesVec3Cmd,
+    'TableGetIndex': TableGetIndexCmd,
+}
+
+def cmd_from_string(code: str, current_func: functions.FunctionDef, constants: ConstantPool, symbol_ids: SymbolIds,
+                    thread_functions: dict[tuple[int, str | None], Iterator['functions.FunctionDef']] | None = None) -> Any:
+    # counterpart to print_function_def, jump offsets are left at 0
     tokens = TokenStream(code)
     
+    def value() -> Any:
+        return read_expr_value(tokens, current_func, constants, symbol_ids)
+    
+    def expression(braces_around_expression = False) -> Expr:
+        return read_expression(tokens, current_func, constants, symbol_ids, braces_around_expression)
+    
+    def value_or_expression(is_const: bool) -> Any:
+        return value() if is_const else expression()
+    
+    def set_source(is_const: bool) -> Any:
+        # const sources are single values, unless they're empty (printed as "(  )")
+        if is_const and tokens.peek() != '(':
+            return value()
+        return expression(True)
+    
     match tokens.advance():
-        case 'GetArgs':
-            func = read_function_id(tokens, current_func, symbol_ids)
-            assert func is not None, "Expected reference to function"
-            assert isinstance(func, functions.FunctionDef), "Expected reference to locally defined function"
-            
-            tokens.expect('(')
-            
-            while tokens.peek() != ')':
-                raise NotImplementedError("TODO")
+        case 'ReturnVal':
+            is_const = read_const_marker(tokens)
             
-            result = GetArgsCmd(func, [])
+            if is_const and tokens.peek() == '':
+                result = ReturnValCmd(is_const, Expr())
+            else:
+                result = ReturnValCmd(is_const, value_or_expression(is_const))
+        case 'Set':
+            is_const = read_const_marker(tokens)
+            destination = value()
+            result = SetCmd(is_const, destination, set_source(is_const))
+        case 'SetKSMUnk':
+            is_const = read_const_marker(tokens)
+            runtime = value()
+            result = SetKSMUnkCmd(is_const, runtime, set_source(is_const))
+        case 'Call':
+            result = read_call(tokens, current_func, constants, symbol_ids)
+        case 'CallAsThread':
+            call = read_call(tokens, current_func, constants, symbol_ids)
+            result = CallAsThreadCmd(call.is_const, call.func, call.args)
+        case 'CallAsChildThread':
+            call = read_call(tokens, current_func, constants, symbol_ids)
+            result = CallAsChildThreadCmd(call.is_const, call.func, call.args)
+        case 'CallVar':
+            is_const = read_const_marker(tokens)
+            func = value()
+            result = CallVarCmd(is_const, func, read_call_args(tokens, is_const, current_func, constants, symbol_ids))
         case 'Return':
+            # ends the body of a thread as well, see read_return_cmd
+            symbol_ids.pop()
             result = ReturnCmd()
-        case 'Call':
-            if tokens.peek() == '*':
-                is_const = True
-                tokens.advance()
-            else:
-                is_const = False
+        case 'GetArgs':
+            func = read_function_id(tokens, current_func, symbol_ids)
+            assert func is not None, tokens.error("Expected reference to function")
+            assert isinstance(func, functions.FunctionDef), tokens.error("Expected reference to locally defined function")
             
-            func_name = tokens.advance()
-            assert is_identifier(func_name), "Expected function name"
-            func = get_func_from_name(func_name, symbol_ids)
+            result = GetArgsCmd(func, read_arg_list(tokens, value))
+        case 'If':
+            condition = expression()
+            unused1, unused2 = read_unused(tokens, 2)
+            result = IfCmd(condition, unused1, 0, unused2)
+        case 'ElseIf':
+            condition = expression()
+            unused1, unused2, unused3 = read_unused(tokens, 3)
+            result = ElseIfCmd(0, unused1, condition, unused2, 0, unused3)
+        case 'Else':
+            result = ElseCmd(0)
+        case 'EndIf':
+            result = EndIfCmd()
+        case 'GotoLabel':
+            result = GotoLabelCmd(value())
+        case 'Label':
+            result = read_label_line(tokens, symbol_ids)
+        case 'Thread1' | 'Thread2' as name:
+            result = read_thread_line(tokens, name == 'Thread1', current_func, constants, symbol_ids, thread_functions)
+        case 'DeleteRuntime':
+            is_const = read_const_marker(tokens)
+            result = DeleteRuntimeCmd(is_const, value())
+        case 'Wait':
+            is_const = read_const_marker(tokens)
+            result = WaitCmd(is_const, value_or_expression(is_const))
+        case 'WaitMs':
+            is_const = read_const_marker(tokens)
+            result = WaitMsCmd(is_const, value_or_expression(is_const))
+        case 'Switch':
+            var = value()
+            result = SwitchCmd(var, *read_unused(tokens, 1), 0)
+        case 'Case':
+            is_const = read_const_marker(tokens)
             
-            args = []
+            match tokens.advance():
+                case '==':
+                    result = CaseEqCmd(is_const, value(), 0)
+                case '<=':
+                    result = CaseLteCmd(is_const, value(), 0)
+                case default:
+                    raise ValueError(tokens.error(f"Expected == or <= after Case, got {default!r}"))
+        case 'CaseRange':
+            is_const = read_const_marker(tokens)
             tokens.expect('(')
-            
-            while tokens.peek() != ')':
-                var = read_var_ref(tokens, current_func, constants, symbol_ids)
-                
-                if is_const:
-                    args.append(var)
-                else:
-                    # TODO: full expressions
-                    args.append(Expr([var] if var is not None else []))
-                
-                if tokens.peek() != ')':
-                    tokens.expect(',')
-            
-            result = CallCmd(is_const, func, args)
+            lower = value()
+            tokens.expect('to')
+            upper = value()
+            tokens.expect(')')
+            result = CaseRangeCmd(is_const, lower, upper, 0)
+        case 'BreakSwitch':
+            result = BreakSwitchCmd()
+        case 'EndSwitch':
+            result = EndSwitchCmd()
+        case 'While':
+            is_const = read_const_marker(tokens)
+            result = WhileCmd(is_const, value_or_expression(is_const), 0)
+        case 'Break':
+            result = BreakCmd()
+        case 'EndWhile':
+            result = EndWhileCmd()
+        case name if name in TABLE_CMDS:
+            cls = TABLE_CMDS[name]
+            args = read_arg_list(tokens, value)
+            assert len(args) == len(cls.__match_args__) - 1, tokens.error(f"{name} takes {len(cls.__match_args__) - 1} arguments")
+            result = cls(False, *args)
+        case 'WaitCompleted':
+            is_const = read_const_marker(tokens)
+            result = WaitCompletedCmd(is_const, value_or_expression(is_const))
+        case 'WaitWhile':
+            condition = expression()
+            result = WaitWhileCmd(condition, *read_unused(tokens, 2))
+        case 'ToInt':
+            result = ToIntCmd(value())
+        case 'ToFloat':
+            result = ToFloatCmd(value())
+        case 'LoadKSM':
+            result = LoadKSMCmd(value())
+        case 'GetArgCount':
+            result = GetArgCountCmd()
+        case name if name.startswith('Noop_0x'):
+            result = NoopCmd(int(name[len('Noop_'):], 16))
+        case name if name.startswith('Unk_0x'):
+            is_const = read_const_marker(tokens)
+            args = read_arg_list(tokens, lambda: read_unknown_arg(tokens, current_func, constants, symbol_ids))
+            result = UnknownCmd(int(name[len('Unk_'):], 16), is_const, args)
         
         case default:
             raise NotImplementedError(f"Instruction {default} not supported yet (can't parse)")
     
+    assert tokens.peek() == '', tokens.error(f"Unexpected {tokens.peek()!r}")
     return result
+
+def read_unused(tokens: TokenStream, count: int) -> list[int]:
+    # Unused ( 0x1, 0x0 ) after the arguments, they're 0 when it's left out
+    if tokens.peek() != 'Unused':
+        return [0] * count
+    
+    tokens.advance()
+    words = read_arg_list(tokens, lambda: int(tokens.advance(), 16))
+    assert len(words) == count, tokens.error(f"Expected {count} unused words")
+    
+    return words
+
+def read_label_line(tokens: TokenStream, symbol_ids: SymbolIds) -> LabelCmd:
+    # Label name, Label label:0x1f or Label ? (at 0x1f) for labels without a definition
+    if tokens.peek() == '?':
+        tokens.advance()
+        tokens.expect('(')
+        tokens.expect('at')
+        offset = int(tokens.advance(), 16)
+        tokens.expect(')')
+        
+        return LabelCmd(offset, None)
+    
+    if tokens.peek() == 'label':
+        label = read_symbol_name(tokens, Label, symbol_ids)
+    else:
+        name = tokens.advance()
+        label = symbol_ids.get_by_name(name, Label)
+        assert label is not None, tokens.error(f"Could not find label {name}")
+    
+    return LabelCmd(label.code_offset if isinstance(label, Label) else 0, label)
+
+def read_thread_line(tokens: TokenStream, is_thread1: bool, current_func: functions.FunctionDef, constants: ConstantPool, symbol_ids: SymbolIds,
+                     thread_functions: dict[tuple[int, str | None], Iterator['functions.FunctionDef']] | None) -> ThreadCmd | Thread2Cmd:
+    # Thread1 "label" Capture ( var, var as 0x1f )
+    # the label stands for the next generated function with that label, as they're numbered in order
+    if tokens.peek() in ('"', 'null'):
+        if tokens.peek() == 'null':
+            tokens.advance()
+            label = None
+        else:
+            match = tokens.match(STRING_PATTERN)
+            assert match is not None, tokens.error("Unclosed thread label")
+            label = json.loads(match.group())
+        
+        assert thread_functions is not None, tokens.error("Threads need the generated thread functions")
+        func = next(thread_functions.get((1 if is_thread1 else 2, label), iter(())), None)
+        assert func is not None, tokens.error(f"No generated function left for thread {label}")
+        
+        if is_thread1:
+            func.thread_references.append(current_func)
+        else:
+            func.thread2_references.append(current_func)
+    else:
+        func = read_expr_value(tokens, current_func, constants, symbol_ids)
+    
+    tokens.expect('Capture')
+    
+    give_args: list[Var | int] = []
+    take_args: list[int] = []
+    
+    def capture():
+        give = read_expr_value(tokens, current_func, constants, symbol_ids)
+        
+        if tokens.peek() == 'as':
+            tokens.advance()
+            take = int(tokens.advance(), 16)
+        else:
+            take = give if isinstance(give, int) else give.id
+        
+        give_args.append(give)
+        take_args.append(take)
+    
+    read_arg_list(tokens, capture)
+    push_thread_captures(symbol_ids, take_args, give_args, is_thread1)
+    
+    if is_thread1:
+        return ThreadCmd(func, take_args, give_args)
+    else:
+        return Thread2Cmd(func, take_args, give_args)
+
+def read_unknown_arg(tokens: TokenStream, current_func: functions.FunctionDef, constants: ConstantPool, symbol_ids: SymbolIds) -> Any:
+    # unknown instructions can contain anything, including the words of expression operators
+    if tokens.peek() in EXPR_SYMBOLS_BY_LABEL and tokens.peek() != ')':
+        return EXPR_SYMBOLS_BY_LABEL[tokens.advance()]
+    
+    return read_expr_value(tokens, current_func, constants, symbol_ids)
@@ -1,34 +1,34 @@
+import ast
+import re
+from typing import Callable, Iterator
+
+import cmds
 import functions
-from other_types import ScriptImport
+from other_types import EXPR_SYMBOLS_BY_LABEL, Expr, ExprValue, Label, ScriptImport
+from tables import Table, TableDataType
 from util import SymbolIds
-from variables import Var
+from variables import ConstantPool, Var, VarCategory
 
 # tokenization
+TOKEN_PATTERN = re.compile(r'\w+|\|\||&&|<<|>>|==|!=|>=|<=|[^ ]')
+# literals are matched on the source text, as they can contain spaces and characters that are tokens of their own
+NUMBER_PATTERN = re.compile(r'([-+\w.]+)`')
+STRING_PATTERN = re.compile(r''''(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"''')
+
 def is_identifier(string: str) -> bool:
     return all(c == '_' or c.isalnum() for c in string)
 
-def tokenize(code: str) -> list[str]:
-    tokens: list[str] = []
-    
-    while len(code) > 0:
-        if code[0] == ' ':
-            code = code[1:]
-            continue
-        
-        if is_identifier(code[0]):
-            token_end = next((i + 1 for i, c in enumerate(code[1:]) if not is_identifier(c)), len(code))
-        else:
-            token_end = 1
-        
-        token, code = code[:token_end], code[token_end:]
-        tokens.append(token)
-    
-    return tokens
+def tokenize(code: str, start: int = 0) -> Iterator[tuple[int, str]]:
+    # identifiers and two character operators are one token, every other character except spaces is a token of its own
+    for match in TOKEN_PATTERN.finditer(code, start):
+        yield match.start(), match.group()
 
 class TokenStream:
     def __init__(self, code: str):
-        self.tokens = iter(tokenize(code))
+        self.code = code
+        self.tokens = tokenize(code)
         self.current = ""
+        self.position = 0
         
         self.advance()
     
@@ -36,20 +36,35 @@ class TokenStream:
         return self.current
     
     def advance(self) -> str:
-        current, self.current = self.current, next(self.tokens, "")
+        current = self.current
+        self.position, self.current = next(self.tokens, (len(self.code), ""))
         return current
     
+    def skip_to(self, position: int):
+        self.tokens = tokenize(self.code, position)
+        self.advance()
+    
+    def match(self, pattern: re.Pattern) -> re.Match | None:
+        # matches the source text at the current token and skips past it
+        match = pattern.match(self.code, self.position)
+        
+        if match is not None:
+            self.skip_to(match.end())
+        
+        return match
+    
+    def error(self, message: str) -> str:
+        return f"{message} at column {self.position + 1} of {self.code!r}"
+    
     def expect(self, expected: str) -> str:
+        position = self.position
         token = self.advance()
-        assert token == expected, f"Expected token {expected!r}, got {token!r}"
+        assert token == expected, f"Expected token {expected!r}, got {token!r} at column {position + 1} of {self.code!r}"
         return expected
 
 # parsing
 def get_func_from_name(name: str, symbol_ids: SymbolIds) -> functions.FunctionDef | ScriptImport:
-    func = None
-    for value in symbol_ids.flat().values():
-        if isinstance(value, (functions.FunctionDef, ScriptImport)) and value.name == name:
-            func = value
+    func = symbol_ids.get_by_name(name, (ScriptImport, functions.FunctionDef))
     
     assert func is not None, f"Could not find function with name {name}"
     return func
@@ -69,50 +84,33 @@ def read_function_id(tokens: TokenStream, current_func: functions.FunctionDef, s
     
     return get_func_from_name(name, symbol_ids)
 
-def read_number_var(tokens: TokenStream, constants: list[Var]) -> Var | None:
-    if not tokens.peek().isdigit():
+def read_number_var(tokens: TokenStream, constants: ConstantPool) -> Var | None:
+    if (match := tokens.match(NUMBER_PATTERN)) is None:
         return None
     
-    # parse number
-    num = tokens.advance()
+    text = match.group(1)
     
-    if tokens.peek() == '.':
-        raise NotImplementedError("Floats not supported yet")
+    if text.lstrip('-').isdigit():
+        return constants.get(1, int(text))
     
-    tokens.expect('`')
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError(f"Invalid number {text!r} in {tokens.code!r}")
     
-    # find var
-    var = next((c for c in constants if c.data_type == 1 and c.user_data == int(num)), None)
-    if var is None:
-        raise ValueError(f"Could not find Int constant with content {num}")
-    
-    return var
+    return constants.get(0, value)
 
-def read_string_var(tokens: TokenStream, constants: list[Var]) -> Var | None:
-    if tokens.peek() not in "'\"":
+def read_string_var(tokens: TokenStream, constants: ConstantPool) -> Var | None:
+    if tokens.peek() not in ("'", '"'):
         return None
     
-    # parse string
-    quote_type = tokens.advance()
-    string = ""
-    
-    while tokens.peek() != quote_type and tokens.peek() != "":
-        string += ' ' + tokens.advance()
-    
-    string = string[1:]
-    
-    if tokens.advance() == "":
-        raise ValueError("Unclosed string")
+    match = tokens.match(STRING_PATTERN)
+    assert match is not None, tokens.error("Unclosed string")
     
-    # find var
-    var = next((c for c in constants if c.data_type == 3 and c.user_data == string), None)
-    if var is None:
-        raise ValueError(f"Could not find String constant with content {string!r}")
-    
-    return var
+    return constants.get(3, ast.literal_eval(match.group()))
 
 def read_var_ref(tokens: TokenStream, current_func: functions.FunctionDef, 
-                 constants: list[Var], symbol_ids: SymbolIds) -> functions.FunctionDef | ScriptImport | Var | None:
+                 constants: ConstantPool, symbol_ids: SymbolIds) -> functions.FunctionDef | ScriptImport | Var | None:
     if (num := read_number_var(tokens, constants)) is not None:
         return num
     elif (string := read_string_var(tokens, constants)) is not None:
@@ -120,4 +118,181 @@ def read_var_ref(tokens: TokenStream, current_func: functions.FunctionDef,
     elif (func := read_function_id(tokens, current_func, symbol_ids)) is not None:
         return func
     else:
-        return None
\ No newline at end of file
+        return None
+
+def read_const_marker(tokens: TokenStream) -> bool:
+    # the * after the name of const instruction variants
+    if tokens.peek() != '*':
+        return False
+    
+    tokens.advance()
+    return True
+
+def read_arg_list[T](tokens: TokenStream, read_arg: Callable[[], T]) -> list[T]:
+    # ( arg, arg, ... )
+    args = []
+    tokens.expect('(')
+    
+    while tokens.peek() != ')':
+        args.append(read_arg())
+        
+        if tokens.peek() != ')':
+            tokens.expect(',')
+    
+    tokens.expect(')')
+    
+    return args
+
+def read_symbol_name(tokens: TokenStream, kind: type, symbol_ids: SymbolIds) -> Label | Table | int:
+    # label:name, table:name and their unnamed forms label:0x1f and table:0x1f
+    tokens.advance()
+    tokens.expect(':')
+    name = tokens.advance()
+    
+    if (value := symbol_ids.get_by_name(name, kind)) is not None:
+        return value
+    
+    assert name.startswith('0x'), tokens.error(f"Could not find {kind.__name__.lower()} {name}")
+    return symbol_ids.get(int(name, 16))
+
+def read_category_var(tokens: TokenStream, symbol_ids: SymbolIds) -> Var | int | None:
+    if tokens.peek() not in VarCategory.__members__:
+        return None
+    
+    category = VarCategory[tokens.advance()]
+    tokens.expect(':')
+    name = tokens.advance()
+    
+    if (var := symbol_ids.get_var(category, name)) is not None:
+        return var
+    
+    assert name.startswith('0x'), tokens.error(f"Could not find variable {category.name}:{name}")
+    return symbol_ids.get(int(name, 16))
+
+def read_call(tokens: TokenStream, current_func: functions.FunctionDef, 
+              constants: ConstantPool, symbol_ids: SymbolIds) -> 'cmds.CallCmd':
+    # the rest of Call name ( args ) and Call* name ( args ) after Call, the arguments of the latter are single values
+    is_const = read_const_marker(tokens)
+    
+    func_name = tokens.advance()
+    assert is_identifier(func_name), tokens.error("Expected function name")
+    
+    if func_name.isdigit():
+        func = int(func_name)
+    else:
+        func = get_func_from_name(func_name, symbol_ids)
+    
+    args = read_call_args(tokens, is_const, current_func, constants, symbol_ids)
+    
+    return cmds.CallCmd(is_const, func, args)
+
+def read_call_args(tokens: TokenStream, is_const: bool, current_func: functions.FunctionDef, 
+                   constants: ConstantPool, symbol_ids: SymbolIds) -> list[Expr | ExprValue]:
+    if is_const:
+        return read_arg_list(tokens, lambda: read_expr_value(tokens, current_func, constants, symbol_ids))
+    else:
+        return read_arg_list(tokens, lambda: Expr(read_expr_elements(tokens, current_func, constants, symbol_ids)))
+
+def read_expr_value(tokens: TokenStream, current_func: functions.FunctionDef, 
+                    constants: ConstantPool, symbol_ids: SymbolIds) -> ExprValue:
+    if (var := read_var_ref(tokens, current_func, constants, symbol_ids)) is not None:
+        return var
+    elif (var := read_category_var(tokens, symbol_ids)) is not None:
+        return var
+    
+    match tokens.peek():
+        case '?':
+            tokens.advance()
+            number = tokens.advance()
+            assert number.startswith('0x'), tokens.error("Expected hex number after ?")
+            return int(number, 16)
+        case 'Call':
+            tokens.advance()
+            return read_call(tokens, current_func, constants, symbol_ids)
+        case 'label':
+            return read_symbol_name(tokens, Label, symbol_ids)
+        case 'table':
+            return read_symbol_name(tokens, Table, symbol_ids)
+        case 'next_function':
+            return EXPR_SYMBOLS_BY_LABEL[tokens.advance()]
+        case default:
+            raise ValueError(tokens.error(f"Expected value, got {default!r}"))
+
+# expressions
+# expressions are stored in infix order, including the parentheses, so parsing
+# them doesn't reorder anything. binding powers only decide where an operand ends
+BINARY_OPERATOR_POWERS = {
+    '||': 1,
+    '&&': 2,
+    '|': 3,
+    '^': 4,
+    '&': 5,
+    '==': 6, '!=': 6,
+    '>': 7, '<': 7, '>=': 7, '<=': 7,
+    '<<': 8, '>>': 8,
+    '+': 9, '-': 9,
+    '*': 10, '/': 10, '%': 10,
+}
+PREFIX_OPERATOR_POWER = 11
+
+def read_operand(tokens: TokenStream, current_func: functions.FunctionDef, 
+                 constants: ConstantPool, symbol_ids: SymbolIds, elements: list[ExprValue]):
+    match tokens.peek():
+        case '(':
+            elements.append(EXPR_SYMBOLS_BY_LABEL[tokens.advance()])
+            read_infix_expr(tokens, 0, current_func, constants, symbol_ids, elements)
+            tokens.expect(')')
+            elements.append(EXPR_SYMBOLS_BY_LABEL[')'])
+        case '-' if NUMBER_PATTERN.match(tokens.code, tokens.position) is None:
+            # negation, as opposed to a negative number
+            elements.append(EXPR_SYMBOLS_BY_LABEL[tokens.advance()])
+            read_infix_expr(tokens, PREFIX_OPERATOR_POWER, current_func, constants, symbol_ids, elements)
+        case _:
+            elements.append(read_expr_value(tokens, current_func, constants, symbol_ids))
+
+def read_infix_expr(tokens: TokenStream, min_power: int, current_func: functions.FunctionDef, 
+                    constants: ConstantPool, symbol_ids: SymbolIds, elements: list[ExprValue]):
+    read_operand(tokens, current_func, constants, symbol_ids, elements)
+    
+    while (power := BINARY_OPERATOR_POWERS.get(tokens.peek(), 0)) > min_power:
+        elements.append(EXPR_SYMBOLS_BY_LABEL[tokens.advance()])
+        read_infix_expr(tokens, power, current_func, constants, symbol_ids, elements)
+
+def read_expr_elements(tokens: TokenStream, current_func: functions.FunctionDef, 
+                       constants: ConstantPool, symbol_ids: SymbolIds) -> list[ExprValue]:
+    # reads until the first token that can't continue the expression, like ',' or ')'
+    elements = []
+    
+    if tokens.peek() not in ('', ',', ')'):
+        read_infix_expr(tokens, 0, current_func, constants, symbol_ids, elements)
+    
+    return elements
+
+def read_expression(tokens: TokenStream, current_func: functions.FunctionDef, 
+                    constants: ConstantPool, symbol_ids: SymbolIds, braces_around_expression = False) -> Expr:
+    # counterpart to print_expr_or_var
+    if braces_around_expression:
+        tokens.expect('(')
+    
+    elements = read_expr_elements(tokens, current_func, constants, symbol_ids)
+    
+    if braces_around_expression:
+        tokens.expect(')')
+    
+    return Expr(elements)
+
+# tables
+def resolve_table_values(table: Table, current_func: functions.FunctionDef | None, 
+                         constants: ConstantPool, symbol_ids: SymbolIds):
+    # values of Var tables are written like references in code, or as plain ids if they couldn't be resolved
+    if table.data_type != TableDataType.Var:
+        return
+    
+    for i, value in enumerate(table.values):
+        if not isinstance(value, str):
+            assert isinstance(value, int), f"Value {value!r} of table {table.name} has to be a reference or an id"
+            continue
+        
+        tokens = TokenStream(value)
+        table.values[i] = read_expr_value(tokens, current_func, constants, symbol_ids)
+        assert tokens.peek() == '', tokens.error("Expected end of table value")
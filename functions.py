@@ -1,12 +1,14 @@
 from array import array
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, is_dataclass
 import json
+from operator import length_hint
 from string import ascii_lowercase
+from typing import Any, Iterator
 
 import cmds
-from other_types import Label, print_expr_or_var, print_function_import, print_label, read_function_imports, read_label
-from tables import Table, print_table, read_table
-from util import SymbolIds, read_string, write_string
+from other_types import Expr, Label, ScriptImport, label_from_yaml, print_expr_or_var, print_function_import, print_label, read_function_imports, read_label, write_label
+from tables import Table, print_table, read_table, table_from_yaml, write_table, write_table_values
+from util import SymbolIds, Timings, read_string, timed, write_string
 from variables import Var, VarCategory, print_var, read_variable, var_from_yaml, write_variable
 
 # function definitions
@@ -19,9 +21,9 @@ class FunctionDef:
     return_var: int
     field_0x34: int
     
-    code: array
+    code: array | memoryview
     code_offset: int
-    instructions: list | None
+    _instructions: list | None
     instruction_strs: list[str] | None
     
     vars: list[Var]
@@ -31,10 +33,34 @@ class FunctionDef:
     # analysis
     thread_references: list['FunctionDef'] = field(default_factory=list)
     thread2_references: list['FunctionDef'] = field(default_factory=list)
+    
+    # script-wide symbols, the code gets decoded with these the first time instructions are accessed
+    symbol_ids: SymbolIds | None = field(default=None, repr=False, compare=False)
+    
+    # 1 or 2 for functions read from yaml that hold the body of a Thread or Thread2
+    generated_from_thread: int = field(default=0, compare=False)
+    
+    # functions read from yaml are assembled into this before the code section gets laid out
+    encoded: 'FunctionCode | None' = field(default=None, repr=False, compare=False)
+    
+    # jump targets relative to the start of the code, in the order of the words holding them.
+    # only set for functions whose jumps don't point where encode_function_code would put them
+    jumps: list[int] | None = field(default=None, compare=False)
+    
+    @property
+    def instructions(self) -> list | None:
+        if self._instructions is None and self.symbol_ids is not None and len(self.code) > 0:
+            analyze_function_def(self, function_symbol_ids(self, self.symbol_ids))
+        
+        return self._instructions
+    
+    @instructions.setter
+    def instructions(self, instructions: list | None):
+        self._instructions = instructions
 
-def read_function_definitions(section: bytes, code_section: bytes) -> list[FunctionDef]:
-    arr = enumerate(array('I', section))
-    code_section_arr = array('I', code_section)
+def read_function_definitions(section: memoryview, code_section: memoryview) -> list[FunctionDef]:
+    arr = enumerate(section.cast('I'))
+    code_section_arr = code_section.cast('I')
     
     count = next(arr)[1]
     definitions = []
@@ -91,6 +117,18 @@ def read_function_definitions(section: bytes, code_section: bytes) -> list[Funct
     assert len(definitions) == count
     return definitions
 
+def function_symbol_ids(fn: FunctionDef, symbol_ids: SymbolIds) -> SymbolIds:
+    local_symbol_ids = symbol_ids.overlay()
+    
+    for var in fn.vars:
+        local_symbol_ids.add(var)
+    for table in fn.tables:
+        local_symbol_ids.add(table)
+    for unk in fn.labels:
+        local_symbol_ids.add(unk)
+    
+    return local_symbol_ids
+
 def analyze_function_def(fn: FunctionDef, symbol_ids: SymbolIds):
     # cache labels by their offset
     labels: dict[int, Label] = {}
@@ -99,15 +137,38 @@ def analyze_function_def(fn: FunctionDef, symbol_ids: SymbolIds):
         labels[label.code_offset] = label
     
     # parse instructions
-    arr = enumerate(fn.code)
+    # (a list iterates as fast as the code view and its iterator knows its position,
+    # which is only needed for the few instructions that store their own offset)
+    words = fn.code.tolist()
+    arr = iter(words)
+    dispatch = cmds.INSTRUCTIONS.dispatch
+    # the options of the dispatch table with the code of this function, made once per opcode
+    code_options: dict[int, cmds.ReadCmdOptions] = {}
     instructions = []
+    # the instructions of blocks with their offsets
+    positioned: list[tuple[Any, int]] = []
     
-    for i, value in arr:
+    for value in arr:
         try:
-            options = cmds.ReadCmdOptions(value & 0xfffffeff, value & 0x100 != 0, fn.code_offset + i)
+            entry = dispatch[value] if value < len(dispatch) else None
             
-            if value & 0xfffffeff in cmds.INSTRUCTIONS.readers:
-                instruction = cmds.INSTRUCTIONS.readers[value & 0xfffffeff](arr, symbol_ids, options)
+            if entry is not None:
+                read_func, shared_options, needs_offset, in_block = entry
+                options = code_options.get(value)
+                
+                if options is None:
+                    options = code_options[value] = cmds.ReadCmdOptions(shared_options.opcode, shared_options.is_const, code=fn.code)
+                
+                if needs_offset or in_block:
+                    offset = len(words) - length_hint(arr) - 1
+                    
+                    if needs_offset:
+                        options = cmds.ReadCmdOptions(options.opcode, options.is_const, fn.code_offset + offset, fn.code)
+                
+                instruction = read_func(arr, symbol_ids, options)
+                
+                if in_block:
+                    positioned.append((instruction, offset))
                 
                 match instruction:
                     case cmds.ThreadCmd(func):
@@ -122,17 +183,105 @@ def analyze_function_def(fn: FunctionDef, symbol_ids: SymbolIds):
                 
                 instructions.append(instruction)
             else:
+                options = cmds.ReadCmdOptions(value & ~cmds.CONST_BIT, value & cmds.CONST_BIT != 0)
                 instructions.append(cmds.read_unknown_cmd(arr, symbol_ids, options))
         except StopIteration:
             pass
     
     fn.instructions = instructions
+    fn.jumps = original_jumps(fn, positioned)
+
+def jump_targets(cmd) -> tuple[int, ...]:
+    # in the order of the words holding them
+    match cmd:
+        case cmds.IfCmd(jump_to=jump_to) | cmds.ElseCmd(jump_to=jump_to):
+            return (jump_to,)
+        case cmds.ElseIfCmd(start_from=start_from, jump_to=jump_to):
+            return (start_from, jump_to)
+        case cmds.SwitchCmd(jump_offset=jump_offset) | cmds.WhileCmd(jump_offset=jump_offset) | \
+                cmds.CaseEqCmd(jump_offset=jump_offset) | cmds.CaseLteCmd(jump_offset=jump_offset) | cmds.CaseRangeCmd(jump_offset=jump_offset):
+            return (jump_offset,)
+        case _:
+            return ()
+
+def original_jumps(fn: FunctionDef, positioned: list[tuple[Any, int]]) -> list[int] | None:
+    # the jump targets of a decoded function relative to its start, None if they're where encode_function_code would put them.
+    # follows its blocks, which hold the target of the pending jump to the next branch (there's at most one) and the ones to the end
+    blocks: list[tuple[type, list[int | None], list[int]]] = []
+    follows_layout = True
+    
+    for cmd, offset in positioned:
+        kind = type(cmd)
+        
+        if kind is cmds.IfCmd:
+            blocks.append((cmds.EndIfCmd, [cmd.jump_to], []))
+        elif kind is cmds.SwitchCmd:
+            blocks.append((cmds.EndSwitchCmd, [None], [cmd.jump_offset]))
+        elif kind is cmds.WhileCmd:
+            blocks.append((cmds.EndWhileCmd, [None], [cmd.jump_offset]))
+        elif kind in cmds.BLOCK_CLOSED_BY:
+            if len(blocks) == 0 or blocks[-1][0] is not cmds.BLOCK_CLOSED_BY[kind]:
+                # the blocks aren't nested the way the assembler needs them, so it can't reassemble the function either way
+                return None
+            
+            _, next_jump, end_jumps = blocks[-1]
+            target = fn.code_offset + offset
+            
+            if next_jump[0] is not None and next_jump[0] != target:
+                follows_layout = False
+            
+            if kind is cmds.ElseIfCmd:
+                next_jump[0] = cmd.jump_to
+                end_jumps.append(cmd.start_from)
+            elif kind is cmds.ElseCmd:
+                next_jump[0] = None
+                end_jumps.append(cmd.jump_to)
+            elif kind is cmds.CaseEqCmd or kind is cmds.CaseLteCmd or kind is cmds.CaseRangeCmd:
+                next_jump[0] = cmd.jump_offset
+            else:
+                if end_jumps.count(target) != len(end_jumps):
+                    follows_layout = False
+                
+                blocks.pop()
+    
+    if follows_layout or len(blocks) > 0:
+        # (unclosed blocks can't be reassembled either)
+        return None
+    
+    return [target - fn.code_offset for cmd, _ in positioned for target in jump_targets(cmd)]
+
+def thread_label(fn: FunctionDef) -> str | None:
+    # the functions generated for Thread and Thread2 bodies are printed without
+    # their leading underscore and numbered suffix, e.g. _evt_main_thread_1 as evt_main_thread
+    if fn.name is None:
+        return None
+    
+    name_start = 1 if fn.name.startswith('_') else 0
+    name_end = fn.name.rfind('_')
+    
+    return fn.name[name_start:name_end if name_end > name_start else len(fn.name)]
+
+def print_capture(give: Var | int, take: int) -> str:
+    # the id a captured variable gets inside of the thread is only printed when it's not the same
+    give_id = give if isinstance(give, int) else give.id
+    
+    if give_id == take:
+        return print_expr_or_var(give)
+    
+    return f"{print_expr_or_var(give)} as 0x{take:x}"
+
+def print_unused(*words: int) -> str:
+    # the unused words of an instruction are only printed when one of them isn't 0
+    if not any(words):
+        return ''
+    
+    return f" Unused ( {', '.join(hex(word) for word in words)} )"
 
-def print_function_def(fn: FunctionDef) -> str:
+def print_function_def(fn: FunctionDef) -> Iterator[str]:
     return_var_var = next((var for var in fn.vars if var.id == fn.return_var), None)
     return_var = print_expr_or_var(return_var_var) if return_var_var is not None else hex(fn.return_var)
     
-    result = f"""  - name: {fn.name if fn.name != None else 'null'}
+    yield f"""  - name: {fn.name if fn.name != None else 'null'}
     id: 0x{fn.id:x}
     is_public: {fn.is_public}
     field_0xc: 0x{fn.field_0xc:x}
@@ -140,33 +289,36 @@ def print_function_def(fn: FunctionDef) -> str:
     field_0x34: 0x{fn.field_0x34:x}\n"""
     
     if fn.vars and len(fn.vars) > 0:
-        result += "    \n    variables:\n"
+        yield "    \n    variables:\n"
         for var in fn.vars:
-            result += print_var(var, 3)
+            yield print_var(var, 3)
     if fn.tables and len(fn.tables) > 0:
-        result += "    \n    tables:\n"
+        yield "    \n    tables:\n"
         for table in fn.tables:
-            result += print_table(table, 3)
+            yield from print_table(table, 3)
     if fn.labels and len(fn.labels) > 0:
-        result += "    \n    labels:\n"
+        yield "    \n    labels:\n"
         for var in fn.labels:
-            result += print_label(var)
+            yield print_label(var)
     
     if len(fn.thread_references) == 1 and len(fn.thread2_references) == 0:
-        result += f"    \n    generated_from_thread: true # used by fn:{fn.thread_references[0].name}\n"
+        yield f"    \n    generated_from_thread: true # used by fn:{fn.thread_references[0].name}\n"
     elif len(fn.thread_references) == 0 and len(fn.thread2_references) == 1:
-        result += f"    \n    generated_from_thread2: true # used by fn:{fn.thread2_references[0].name}\n"
+        yield f"    \n    generated_from_thread2: true # used by fn:{fn.thread2_references[0].name}\n"
     elif fn.instructions and len(fn.instructions) > 0:
-        result += "    \n    "
+        if fn.jumps is not None:
+            yield f"    \n    # jump targets, the assembler would lay them out differently\n    jumps: [{', '.join(hex(x) for x in fn.jumps)}]\n"
+        
+        yield "    \n    "
         
         if len(fn.thread_references) >= 1:
             thread_references = ', '.join(print_expr_or_var(x) for x in fn.thread_references)
-            result += f"# used by Threads: {thread_references}\n    "
+            yield f"# used by Threads: {thread_references}\n    "
         if len(fn.thread2_references) >= 1:
             thread2_references = ', '.join(print_expr_or_var(x) for x in fn.thread2_references)
-            result += f"# used by Thread2s: {thread2_references}\n    "
+            yield f"# used by Thread2s: {thread2_references}\n    "
         
-        result += "body:\n"
+        yield "body:\n"
         start_indented_block = False
         indentation = 0
         
@@ -187,7 +339,7 @@ def print_function_def(fn: FunctionDef) -> str:
                 case cmds.CallAsChildThreadCmd(is_const, func, args):
                     value = f"CallAsChildThread{'*' if is_const else ' '} {func if isinstance(func, int) else func.name} ( {', '.join(print_expr_or_var(x) for x in args)} )"
                 case cmds.CallVarCmd(is_const, func, args):
-                    value = f"CallVar{'*' if is_const else '' } {func if isinstance(func, int) else func.name} {args}"
+                    value = f"CallVar{'*' if is_const else ' '} {print_expr_or_var(func)} ( {', '.join(print_expr_or_var(x) for x in args)} )"
                 case cmds.ReturnCmd():
                     if indentation > 0:
                         indentation -= 1
@@ -197,7 +349,7 @@ def print_function_def(fn: FunctionDef) -> str:
                     value = f"GetArgs fn:{'self' if func.name == fn.name else func.name} ( {', '.join(print_expr_or_var(x) for x in args)} )"
                 case cmds.IfCmd(condition, unused1, jump_to, unused2):
                     start_indented_block = True
-                    value = f"If {print_expr_or_var(condition)}" # , {hex(unused1)}, {hex(jump_to)}, {hex(unused2)}
+                    value = f"If {print_expr_or_var(condition)}{print_unused(unused1, unused2)}"
                 case cmds.IfEqualCmd(var1, var2, jump_to):
                     start_indented_block = True
                     value = f"IfEqual ( {print_expr_or_var(var1)}, {print_expr_or_var(var2)} )" # , {hex(jump_to)}
@@ -214,7 +366,7 @@ def print_function_def(fn: FunctionDef) -> str:
                         indentation -= 1
                     start_indented_block = True
                     # value = f"ElseIf ( {hex(start_from)}, {hex(unused1)}, {print_expr_or_var(condition)}, {hex(unused2)}, {hex(jump_to)}, {hex(unused3)} )"
-                    value = f"ElseIf {print_expr_or_var(condition)}"
+                    value = f"ElseIf {print_expr_or_var(condition)}{print_unused(unused1, unused2, unused3)}"
                 case cmds.EndIfCmd():
                     if indentation > 0:
                         indentation -= 1
@@ -241,11 +393,10 @@ def print_function_def(fn: FunctionDef) -> str:
                     
                     opcode = "Thread1" if isinstance(inst, cmds.ThreadCmd) else "Thread2"
                     if isinstance(func, FunctionDef):
-                        name_start = 1 if func.name is not None and func.name.startswith('_') else 0
-                        label_or_func = json.dumps(func.name[name_start:func.name.rindex('_')] if func.name is not None else func.name)
+                        label_or_func = json.dumps(thread_label(func))
                     else:
                         label_or_func = print_expr_or_var(func)
-                    captures = ', '.join(print_expr_or_var(var) for var in give_args)
+                    captures = ', '.join(print_capture(give, take) for give, take in zip(give_args, take_args))
                     
                     value = f"{opcode} {label_or_func} Capture ( {captures} )"
                 case cmds.DeleteRuntimeCmd(is_const, duration):
@@ -256,7 +407,7 @@ def print_function_def(fn: FunctionDef) -> str:
                     value = f"WaitMs{'*' if is_const else '' } {print_expr_or_var(duration)}"
                 case cmds.SwitchCmd(var, unused, jump_offset):
                     start_indented_block = True
-                    value = f"Switch {print_expr_or_var(var)}" # , {hex(unused)}, {hex(jump_offset)}                
+                    value = f"Switch {print_expr_or_var(var)}{print_unused(unused)}"                
                 case cmds.CaseEqCmd(is_const, var, jump_offset):
                     start_indented_block = True
                     value = f"Case{'*' if is_const else '' } == {print_expr_or_var(var)}" # , {hex(jump_offset)}       
@@ -265,7 +416,7 @@ def print_function_def(fn: FunctionDef) -> str:
                     value = f"Case{'*' if is_const else '' } <= {print_expr_or_var(var)}" # , {hex(jump_offset)}
                 case cmds.CaseRangeCmd(is_const, lower, upper, jump_offset):
                     start_indented_block = True
-                    value = f"CaseRange{'*' if is_const else '' } ( {print_expr_or_var(lower)} to {print_expr_or_var(upper)}" # , {hex(jump_offset)}
+                    value = f"CaseRange{'*' if is_const else '' } ( {print_expr_or_var(lower)} to {print_expr_or_var(upper)} )" # , {hex(jump_offset)}
                 case cmds.BreakSwitchCmd():
                     if indentation > 0:
                         indentation -= 1
@@ -297,8 +448,8 @@ def print_function_def(fn: FunctionDef) -> str:
                     value = f"TableGetIndex ( {print_expr_or_var(arrayt)}, {print_expr_or_var(occurance)}, {print_expr_or_var(var)} )"
                 case cmds.WaitCompletedCmd(is_const, runtime):
                     value = f"WaitCompleted{'*' if is_const else '' } {print_expr_or_var(runtime)}"
-                case cmds.WaitWhileCmd(condition):
-                    value = f"WaitWhile {print_expr_or_var(condition)}"
+                case cmds.WaitWhileCmd(condition, unused1, unused2):
+                    value = f"WaitWhile {print_expr_or_var(condition)}{print_unused(unused1, unused2)}"
                 case cmds.ToIntCmd(var):
                     value = f"ToInt {print_expr_or_var(var)}"
                 case cmds.ToFloatCmd(var):
@@ -314,65 +465,119 @@ def print_function_def(fn: FunctionDef) -> str:
                 case _:
                     raise Exception()
             
-            if ': ' in value:
-                result += f"      - {'    ' * indentation}'{value}'\n"
+            if ': ' in value or ' #' in value:
+                yield f"      - {'    ' * indentation}'{value.replace("'", "''")}'\n"
             else:
-                result += f"      - {'    ' * indentation}{value}\n"
-    
-    return result
+                yield f"      - {'    ' * indentation}{value}\n"
 
-def print_function_imports(sections: list[bytes], symbol_ids: SymbolIds) -> str:
+def print_function_imports(sections: list[memoryview], symbol_ids: SymbolIds, timings: Timings | None = None) -> Iterator[str]:
     # section 5 (function imports)
-    imports = read_function_imports(sections[5])
+    with timed(timings, 'section decode'):
+        imports = read_function_imports(sections[5])
     
     if len(imports) == 0:
-        return ""
+        return
     
-    out_str = '\nimports:\n'
+    yield '\nimports:\n'
     
     for fn in imports:
         symbol_ids.add(fn)
-        out_str += print_function_import(fn)
+        yield print_function_import(fn)
+
+def referenced_functions(value) -> Iterator[FunctionDef]:
+    # walks through instructions, their arguments and expressions
+    if isinstance(value, FunctionDef):
+        yield value
+    elif isinstance(value, list):
+        for element in value:
+            yield from referenced_functions(element)
+    elif isinstance(value, Expr):
+        yield from referenced_functions(value.elements)
+    elif is_dataclass(value):
+        for value_field in fields(value):
+            yield from referenced_functions(getattr(value, value_field.name))
+
+def containing_functions(definitions: list[FunctionDef], fn: FunctionDef) -> Iterator[FunctionDef]:
+    # the functions whose code contains the code of fn, like the ones a Thread body was generated from
+    if len(fn.code) == 0:
+        return
     
-    return out_str
+    end = fn.code_offset + len(fn.code)
+    
+    for owner in definitions:
+        if owner.code_offset <= fn.code_offset and end <= owner.code_offset + len(owner.code) and len(owner.code) > len(fn.code):
+            yield owner
 
-def print_function_definitions(sections: list[bytes], symbol_ids: SymbolIds) -> str:
+def select_function_definitions(definitions: list[FunctionDef], names: list[str]) -> list[FunctionDef]:
+    # the requested functions and everything they reference, decoding only those.
+    # names the script doesn't have are skipped, see main.ksm_to_yaml
+    selected: set[int] = set()
+    pending = [fn for fn in definitions if fn.name in names]
+    
+    while len(pending) > 0:
+        fn = pending.pop()
+        
+        if id(fn) in selected:
+            continue
+        
+        selected.add(id(fn))
+        pending.extend(referenced_functions(fn.instructions))
+        
+        # the body of a generated thread function is printed in the function it was generated from,
+        # which also resolves its captured variables
+        pending.extend(containing_functions(definitions, fn))
+    
+    return [fn for fn in definitions if id(fn) in selected]
+
+def print_function_definitions(sections: list[memoryview], symbol_ids: SymbolIds, names: list[str] | None = None,
+                               timings: Timings | None = None) -> Iterator[str]:
     # section 1 (function definitions)
-    definitions = read_function_definitions(sections[1], sections[7])
+    with timed(timings, 'section decode'):
+        definitions = read_function_definitions(sections[1], sections[7])
     
     if len(definitions) == 0:
-        return ""
+        return
     
     for fn in definitions:
         symbol_ids.add(fn)
     
+    # function bodies are decoded lazily
     for fn in definitions:
-        if fn.code is not None and len(fn.code) > 0:
-            local_symbol_ids = symbol_ids.copy()
-            
-            for var in fn.vars:
-                local_symbol_ids.add(var)
-            for table in fn.tables:
-                local_symbol_ids.add(table)
-            for unk in fn.labels:
-                local_symbol_ids.add(unk)
-            
-            analyze_function_def(fn, local_symbol_ids)
+        fn.symbol_ids = symbol_ids
     
-    out_str = '\ndefinitions:\n'
-    is_first = True
+    # printing only starts once every printed function is analyzed, since the output of
+    # a function depends on the thread references found in other functions
+    with timed(timings, 'section decode'):
+        if names is not None:
+            definitions = select_function_definitions(definitions, names)
+        else:
+            for fn in definitions:
+                fn.instructions
+    
+    if len(definitions) == 0:
+        return
+    
+    yield '\ndefinitions:\n'
+    
+    # the last chunk of each definition is held back until it's known
+    # whether a separator line has to be written after it
+    previous = None
     
     for fn in definitions:
-        if not is_first:
-            if out_str.endswith('  \n'):
-                out_str = out_str[:-5] + '\n'
-            else:
-                out_str += '    \n'
+        for chunk in print_function_def(fn):
+            if previous is not None:
+                yield previous
+            previous = chunk
         
-        out_str += print_function_def(fn)
-        is_first = False
+        if fn is not definitions[-1]:
+            assert previous is not None
+            if previous.endswith('  \n'):
+                previous = previous[:-5] + '\n'
+            else:
+                previous += '    \n'
     
-    return out_str
+    if previous is not None:
+        yield previous
 
 def function_definitions_from_yaml(function_definitions: list) -> list[FunctionDef]:
     out: list[FunctionDef] = []
@@ -397,7 +602,7 @@ def function_definitions_from_yaml(function_definitions: list) -> list[FunctionD
         field_0xc = obj['field_0xc']
         
         assert 'return_var' in obj and isinstance(obj['return_var'], (str, int)), "Function's 'return_var' (required) has to be a string or integer"
-        return_var_str = obj['return_var']
+        return_var_obj = obj['return_var']
         
         assert 'field_0x34' in obj and isinstance(obj['field_0x34'], int), "Function's 'field_0x34' (required) has to be an integer"
         field_0x34 = obj['field_0x34']
@@ -414,14 +619,35 @@ def function_definitions_from_yaml(function_definitions: list) -> list[FunctionD
         else:
             vars = []
         
-        assert 'tables' not in obj, "TODO"
-        assert 'labels' not in obj, "TODO"
+        if isinstance(return_var_obj, str):
+            # printed like a reference to one of the function's variables
+            return_var_var = next((var for var in vars if print_expr_or_var(var) == return_var_obj), None)
+            assert return_var_var is not None, f"Function's 'return_var' {return_var_obj} is not one of its variables"
+            return_var = return_var_var.id
+        else:
+            return_var = return_var_obj
         
-        code_offset = 0 # TODO
+        tables_obj = obj.get('tables') or []
+        assert isinstance(tables_obj, list), "Function tables have to be a list of tables"
+        tables = [table_from_yaml(table_obj) for table_obj in tables_obj]
+        
+        labels_obj = obj.get('labels') or []
+        assert isinstance(labels_obj, list), "Function labels have to be a list of labels"
+        labels = [label_from_yaml(label_obj) for label_obj in labels_obj]
+        
+        # assigned when the code section gets laid out
+        code_offset = 0
         code = array('I', [])
         
-        tables = []
-        labels = []
+        if obj.get('generated_from_thread'):
+            generated_from_thread = 1
+        elif obj.get('generated_from_thread2'):
+            generated_from_thread = 2
+        else:
+            generated_from_thread = 0
+        
+        jumps = obj.get('jumps')
+        assert jumps is None or isinstance(jumps, list) and all(isinstance(x, int) for x in jumps), "Function jumps have to be a list of offsets"
         
         if 'body' in obj and obj['body'] is not None:
             assert isinstance(obj['body'], list), "Function body has to be a list of instructions"
@@ -430,63 +656,256 @@ def function_definitions_from_yaml(function_definitions: list) -> list[FunctionD
             for line in body_obj:
                 assert isinstance(line, str), "Function body has to be a list of instructions"
         else:
-            raise NotImplementedError()
+            # generated thread functions and functions without code
+            body_obj = []
         
-        out.append(FunctionDef(name, id, is_public, field_0xc, 0, field_0x34, code, code_offset, None, body_obj, vars, tables, labels))
+        out.append(FunctionDef(name, id, is_public, field_0xc, return_var, field_0x34, code, code_offset, None, body_obj, vars, tables, labels,
+                               generated_from_thread=generated_from_thread, jumps=jumps))
     
     return out
 
-def write_function_def(fn: FunctionDef) -> bytearray:
-    out = array('I')
+def claim_in_order(functions: list[FunctionDef], claimed: list[FunctionDef]) -> Iterator[FunctionDef]:
+    for fn in functions:
+        claimed.append(fn)
+        yield fn
+
+def generated_thread_functions(definitions: list[FunctionDef], claimed: list[FunctionDef] | None = None) -> dict[tuple[int, str | None], Iterator[FunctionDef]]:
+    # Thread1 and Thread2 refer to their generated function by label, each one takes the next function with that label.
+    # the functions that have been taken are added to claimed
+    functions: dict[tuple[int, str | None], list[FunctionDef]] = {}
+    
+    for fn in definitions:
+        if fn.generated_from_thread != 0:
+            functions.setdefault((fn.generated_from_thread, thread_label(fn)), []).append(fn)
+    
+    if claimed is None:
+        return {key: iter(fns) for key, fns in functions.items()}
     
+    return {key: claim_in_order(fns, claimed) for key, fns in functions.items()}
+
+def claim_thread_functions(fn: FunctionDef, code: 'FunctionCode', definitions: dict[int, FunctionDef],
+                           thread_functions: dict[tuple[int, str | None], Iterator[FunctionDef]]) -> bool:
+    # takes the generated functions for the threads of a function that isn't assembled again,
+    # it's only up to date if they're the same ones as when it was assembled
+    for id in code.claimed_functions:
+        generated = definitions.get(id)
+        
+        if generated is None:
+            return False
+        
+        func = next(thread_functions.get((generated.generated_from_thread, thread_label(generated)), iter(())), None)
+        
+        if func is not generated:
+            return False
+        
+        if func.generated_from_thread == 1:
+            func.thread_references.append(fn)
+        else:
+            func.thread2_references.append(fn)
+    
+    return True
+
+def write_function_def(fn: FunctionDef, out: array[int]):
     out.append(0xFFFFFFFF if fn.name is not None else 0)
     out.append(fn.id)
     out.append(fn.is_public)
     out.append(fn.field_0xc)
-    out.append(0) # code offset and code end will be patched in later
-    out.append(0)
+    out.append(fn.code_offset)
+    out.append(fn.code_offset + len(fn.code))
     out.append(fn.return_var)
     out.append(fn.field_0x34)
     
     if fn.name is not None:
         out.extend(write_string(fn.name))
     
-    if len(fn.vars) > 0:
-        out.append(len(fn.vars))
-        
-        for var in fn.vars:
-            out.extend(write_variable(var))
+    out.append(len(fn.vars))
+    for var in fn.vars:
+        out.extend(write_variable(var))
     
-    out.append(0)
-    out.append(0)
+    out.append(len(fn.tables))
+    for table in fn.tables:
+        out.extend(write_table(table))
     
-    return bytearray(out)
+    out.append(len(fn.labels))
+    for label in fn.labels:
+        out.extend(write_label(label))
 
-def parse_function_definitions(input_file: dict, symbol_ids: SymbolIds) -> tuple[list[FunctionDef], bytearray]:
+def parse_function_definitions(input_file: dict, symbol_ids: SymbolIds) -> list[FunctionDef]:
     if 'definitions' not in input_file:
-        return [], bytearray([0, 0, 0, 0])
+        return []
     
     assert isinstance(input_file['definitions'], list)
     definitions = function_definitions_from_yaml(input_file['definitions'])
     
-    out = bytearray(array('I', [len(definitions)]))
-    
     for definition in definitions:
         symbol_ids.add(definition)
-        out.extend(write_function_def(definition))
     
-    return definitions, out
+    return definitions
+
+def write_function_definitions(definitions: list[FunctionDef]) -> array[int]:
+    # written once the code section is laid out, as it contains the code offsets
+    out = array('I', [len(definitions)])
+    
+    for definition in definitions:
+        write_function_def(definition, out)
+    
+    return out
 
-def parse_function_implementations(funcs: list[FunctionDef], symbol_ids: SymbolIds) -> bytearray:
+@dataclass(slots=True)
+class FunctionCode:
+    # the code of a function assembled as if it started at offset 0. Placing it somewhere else
+    # only moves the words holding jump targets, its labels and the thread bodies
+    words: array[int]
+    relocations: array[int]
+    label_offsets: dict[int, int] = field(default_factory=dict)
+    thread_ranges: dict[int, tuple[int, int]] = field(default_factory=dict)
+    
+    # side effects of parsing its instructions, redone when the code gets reused
+    claimed_functions: list[int] = field(default_factory=list)
+    interned_constants: list[tuple[int, Any]] = field(default_factory=list)
+
+@dataclass(slots=True)
+class OpenBlock:
+    # a control flow block whose jumps point at instructions that haven't been written yet.
+    # the jumps are the indexes of the words that hold the target offsets
+    closed_by: type
+    next_jumps: list[int]
+    end_jumps: list[int]
+
+def innermost_block(blocks: list[OpenBlock], closed_by: type, cmd) -> OpenBlock:
+    assert len(blocks) > 0 and blocks[-1].closed_by is closed_by, f"{type(cmd).__name__} outside of its block"
+    return blocks[-1]
+
+def patch_jumps(out: array[int], jumps: list[int], offset: int, relocations: array[int]):
+    for index in jumps:
+        out[index] = offset
+    
+    relocations.extend(jumps)
+    jumps.clear()
+
+def encode_function_code(fn: FunctionDef) -> FunctionCode:
+    # writes the instructions of a function and resolves its labels, jumps and thread bodies on the way.
+    # offsets point at the opcode of an instruction and are relative to the start of the function until it's placed.
+    # If and ElseIf jump to the next branch, Else, ElseIf and Switch to the end of their block,
+    # Case to the next Case and While to its EndWhile. This layout is a guess that hasn't been checked against
+    # the game's scripts, functions that were disassembled with other jump targets keep them (see original_jumps)
+    out = array('I')
+    code = FunctionCode(out, array('I'))
+    blocks: list[OpenBlock] = []
+    threads: list[tuple[FunctionDef | ScriptImport | int, int]] = []
+    writers = cmds.INSTRUCTIONS.writers
+    jump_words: list[int] = []
+    offsets: list[int] = []
+    
+    for cmd in fn.instructions:
+        offset = len(out)
+        
+        if fn.jumps is not None:
+            offsets.append(offset)
+        
+        match cmd:
+            case cmds.ElseIfCmd() | cmds.ElseCmd():
+                patch_jumps(out, innermost_block(blocks, cmds.EndIfCmd, cmd).next_jumps, offset, code.relocations)
+            case cmds.CaseEqCmd() | cmds.CaseLteCmd() | cmds.CaseRangeCmd():
+                patch_jumps(out, innermost_block(blocks, cmds.EndSwitchCmd, cmd).next_jumps, offset, code.relocations)
+            case cmds.EndIfCmd() | cmds.EndSwitchCmd() | cmds.EndWhileCmd():
+                block = innermost_block(blocks, type(cmd), cmd)
+                patch_jumps(out, block.next_jumps, offset, code.relocations)
+                patch_jumps(out, block.end_jumps, offset, code.relocations)
+                blocks.pop()
+            case cmds.LabelCmd(label=Label() as label):
+                code.label_offsets[label.id] = offset
+        
+        assert type(cmd) in writers, f"Instruction {type(cmd).__name__} not supported yet"
+        writers[type(cmd)](cmd, out)
+        end = len(out)
+        
+        match cmd:
+            case cmds.IfCmd():
+                blocks.append(OpenBlock(cmds.EndIfCmd, [end - 2], []))
+                jump_words.append(end - 2)
+            case cmds.ElseIfCmd():
+                blocks[-1].end_jumps.append(offset + 1)
+                blocks[-1].next_jumps.append(end - 2)
+                jump_words += (offset + 1, end - 2)
+            case cmds.ElseCmd():
+                blocks[-1].end_jumps.append(end - 1)
+                jump_words.append(end - 1)
+            case cmds.SwitchCmd():
+                blocks.append(OpenBlock(cmds.EndSwitchCmd, [], [end - 1]))
+                jump_words.append(end - 1)
+            case cmds.CaseEqCmd() | cmds.CaseLteCmd() | cmds.CaseRangeCmd():
+                blocks[-1].next_jumps.append(end - 1)
+                jump_words.append(end - 1)
+            case cmds.WhileCmd():
+                blocks.append(OpenBlock(cmds.EndWhileCmd, [], [end - 1]))
+                jump_words.append(end - 1)
+            case cmds.ThreadCmd(func) | cmds.Thread2Cmd(func):
+                threads.append((func, end))
+            case cmds.ReturnCmd() if len(threads) > 0:
+                # the body of a thread is the code of the function generated for it
+                func, thread_start = threads.pop()
+                if isinstance(func, FunctionDef):
+                    code.thread_ranges[func.id] = (thread_start, end)
+    
+    assert len(blocks) == 0, f"{blocks[-1].closed_by.__name__[:-3]} missing in function {fn.name}"
+    assert len(threads) == 0, f"Return missing after thread in function {fn.name}"
+    
+    if fn.jumps is not None:
+        # the jump words are relocated like the laid out ones, as long as the ones into the function still point at instructions.
+        # jumps out of it are kept as well, wrapping around like the words do
+        targets = set(offsets)
+        targets.add(len(out))
+        assert len(fn.jumps) == len(jump_words) and all(target in targets for target in fn.jumps if 0 <= target <= len(out)), \
+            f"The jumps of function {fn.name} don't match its body, remove them to lay them out again"
+        
+        for index, target in zip(jump_words, fn.jumps):
+            out[index] = target & 0xFFFFFFFF
+    
+    return code
+
+def place_function_code(fn: FunctionDef, out: array[int], code_ranges: dict[int, tuple[int, int]]):
+    code = fn.encoded
+    assert code is not None
+    
+    start = len(out)
+    offset = start - 1
+    out.extend(code.words)
+    
+    for index in code.relocations:
+        out[start + index] = (out[start + index] + offset) & 0xFFFFFFFF
+    
+    for label in fn.labels:
+        if label.id in code.label_offsets:
+            label.code_offset = code.label_offsets[label.id] + offset
+    
+    for id, (thread_start, thread_end) in code.thread_ranges.items():
+        code_ranges[id] = (thread_start + offset, thread_end + offset)
+    
+    # a generated function that was already placed by its thread keeps the range of the thread body
+    code_ranges.setdefault(fn.id, (offset, offset + len(code.words)))
+
+def parse_function_implementations(funcs: list[FunctionDef], tables: list[Table]) -> array[int]:
+    # lays out the code section: table values first, then the code of every function in reverse order.
+    # code offsets, label offsets and the start offsets of tables are assigned on the way
     out = array('I')
     
-    out.append(0) # amount of 32-bit words in section, will be patched in later
+    out.append(0) # amount of 32-bit words in section, patched in at the end
+    
+    for table in tables:
+        if len(table.values) > 0:
+            write_table_values(table, out)
+    
+    code_ranges: dict[int, tuple[int, int]] = {}
     
     for func in funcs[::-1]:
-        assert func.instructions is not None
-        
-        for cmd in func.instructions:
-            assert type(cmd) in cmds.INSTRUCTIONS.writers, f"Instruction {type(cmd).__name__} not supported yet"
-            cmds.INSTRUCTIONS.writers[type(cmd)](cmd, out)
+        place_function_code(func, out, code_ranges)
     
-    return bytearray(out)
+    for func in funcs:
+        code_offset, code_end = code_ranges[func.id]
+        func.code_offset = code_offset
+        func.code = out[code_offset + 1:code_end + 1]
+    
+    out[0] = len(out) - 1
+    
+    return out
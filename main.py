@@ -1,21 +1,50 @@
 #!/bin/env python3
+from argparse import ArgumentParser
 from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from glob import glob
+import io
+from itertools import repeat
+import mmap
+import os
+import sys
 from struct import unpack
-from sys import argv
-from typing import TypeVar
+from time import perf_counter, sleep
+from typing import Any, Callable, Iterable, Iterator, TextIO, TypeVar
 
 import yaml
 
+from cache import InputFiles, cache_filename, load_cached, store_cached
 from cmds import cmd_from_string
-from functions import parse_function_definitions, parse_function_implementations, print_function_definitions, print_function_imports
-from other_types import parse_imports
-from tables import print_tables
-from util import SymbolIds
-from variables import VarCategory, parse_variables, write_variables_yaml
+from code_parser import resolve_table_values
+from functions import FunctionCode, FunctionDef, claim_thread_functions, encode_function_code, function_symbol_ids, generated_thread_functions, \
+    parse_function_definitions, parse_function_implementations, print_function_definitions, print_function_imports, read_function_definitions, \
+    write_function_definitions
+from other_types import ScriptImport, parse_imports, write_imports
+from tables import Table, print_tables, tables_from_yaml, write_table_defs
+from util import SymbolIds, Timings, timed
+from variables import ConstantPool, Var, VarCategory, add_temp_vars, parse_variables, write_variable_defs, write_variables_yaml
 
 T = TypeVar('T')
 
-def read_ksm_container(file: bytes) -> list[bytes]:
+# libyaml's loader is many times faster than the pure Python one, but PyYAML can be installed without it
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def load_yaml(stream: str | TextIO) -> Any:
+    return yaml.load(stream, Loader=YamlLoader)
+
+def open_ksm_file(filename: str) -> mmap.mmap | bytes:
+    # the mapping stays open as long as any section view into it is alive,
+    # only the pages of the sections that actually get read are loaded from disk
+    with open(filename, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return f.read()
+
+def read_ksm_container(file: mmap.mmap | bytes) -> list[memoryview]:
     header = list(unpack('4siiiiiiiiii', file[:0x2c]))
     assert header[0] == b'KSMR'
     assert header[1] == 0x10300
@@ -23,13 +52,14 @@ def read_ksm_container(file: bytes) -> list[bytes]:
     
     header[10] = len(file) // 4
     
-    # god python can be so beautiful
-    sections = [file[start * 4:end * 4] for start, end in zip(header[2:], header[3:])]
+    # sections are views into the file, so no section data gets copied
+    view = memoryview(file)
+    sections = [view[start * 4:end * 4] for start, end in zip(header[2:], header[3:])]
     return sections
 
-def print_section_0(sections: list[bytes]) -> str:
+def print_section_0(sections: list[memoryview]) -> str:
     section = sections[0]
-    arr = array('I', section)
+    arr = section.cast('I')
     
     assert len(arr) == 3
     assert arr[0] == 0
@@ -40,105 +70,580 @@ def print_section_0(sections: list[bytes]) -> str:
     
     return out_str
 
-def ksm_to_yaml(filename: str):
-    with open(filename, 'rb') as f:
-        input_file = f.read()
+def ksm_to_yaml(filename: str, out_filename: str | None = None, var_out_filename: str | None = None,
+                function_names: list[str] | None = None, timings: Timings | None = None) -> list[str]:
+    """Returns the function names that were asked for but aren't in the script, they're left out of the output."""
+    if out_filename is None:
+        out_filename = filename + '.yaml'
+    if var_out_filename is None:
+        var_out_filename = out_filename[:-len('.yaml')] + '.variables.yaml'
     
-    sections = read_ksm_container(input_file)
+    with timed(timings, 'container read'):
+        sections = read_ksm_container(open_ksm_file(filename))
     
-    symbol_ids = SymbolIds()
-    write_variables_yaml(sections, symbol_ids)
+    missing_names: list[str] = []
     
-    # output main yaml
-    main_out_str = print_section_0(sections)
-
-    main_out_str += print_function_imports(sections, symbol_ids)
-    main_out_str += print_tables(sections, symbol_ids)
-    main_out_str += print_function_definitions(sections, symbol_ids)
+    if function_names is not None:
+        known = {fn.name for fn in read_function_definitions(sections[1], sections[7])}
+        missing_names = [name for name in function_names if name not in known]
+        function_names = [name for name in function_names if name in known]
     
-    with open(argv[1] + '.yaml', 'w') as f:
-        f.write(main_out_str)
+    # written to temporary files first, so a script that fails to decode can't leave truncated output behind
+    temp_filename = out_filename + '.tmp'
+    var_temp_filename = var_out_filename + '.tmp'
+    
+    try:
+        with timed(timings, 'YAML emit'), open(temp_filename, 'w') as f, open(var_temp_filename, 'w', encoding='utf-8') as var_f:
+            write_ksm_yaml(sections, f, var_f, function_names, timings)
+    except BaseException:
+        for name in (temp_filename, var_temp_filename):
+            if os.path.exists(name):
+                os.remove(name)
+        raise
+    
+    os.replace(var_temp_filename, var_out_filename)
+    os.replace(temp_filename, out_filename)
+    
+    return missing_names
 
-def write_ksm_container(sections: list[bytearray]) -> bytes:
-    section_indices = [2 + len(sections)]
-    for section in sections[:-1]:
-        assert len(section) % 4 == 0
-        section_indices.append(section_indices[-1] + len(section) // 4)
+def write_ksm_yaml(sections: list[memoryview], f: TextIO, var_f: TextIO, function_names: list[str] | None = None,
+                   timings: Timings | None = None):
+    symbol_ids = SymbolIds()
+    write_variables_yaml(sections, symbol_ids, var_f, timings)
     
+    # output main yaml, written out piece by piece as it gets printed
+    f.write(print_section_0(sections))
+    
+    # every part is written out completely before the next one starts,
+    # as they depend on the symbols added by the previous ones
+    f.writelines(print_function_imports(sections, symbol_ids, timings))
+    f.writelines(print_tables(sections, symbol_ids, timings))
+    f.writelines(print_function_definitions(sections, symbol_ids, function_names, timings))
+
+def ksm_container_header(sections: list[array[int]]) -> array[int]:
+    # magic, version, the start of every section and a zero terminator
     out_arr = array('I', b'KSMR\0\x03\x01\0')
-    out_arr.extend(section_indices)
     
-    out = bytearray(out_arr)
+    section_index = 3 + len(sections)
     for section in sections:
-        out.extend(section)
+        out_arr.append(section_index)
+        section_index += len(section)
     
-    return bytes(out)
+    out_arr.append(0)
+    return out_arr
 
-def parse_section_0(input_file: dict) -> bytearray:
+def write_ksm_container(sections: list[array[int]]) -> bytearray:
+    # the size of every section is known, so everything gets copied into its final place in a single buffer
+    parts = [ksm_container_header(sections), *sections]
+    out = bytearray(4 * sum(len(part) for part in parts))
+    view = memoryview(out).cast('I')
+    
+    position = 0
+    for part in parts:
+        view[position:position + len(part)] = part
+        position += len(part)
+    
+    return out
+
+def write_ksm_file(filename: str, sections: list[array[int]]):
+    # the sections are written one after the other instead of being joined first
+    with open(filename, 'wb') as f:
+        f.write(ksm_container_header(sections))
+        f.writelines(sections)
+
+def parse_section_0(input_file: dict) -> array[int]:
     section_0 = input_file['section_0']
     assert isinstance(section_0, list), "Section 0 has invalid"
     assert len(section_0) == 1, "Section 0 has invalid"
     assert isinstance(section_0[0], int), "Section 0 has invalid"
     
-    out_arr = array('I', [0, 0, section_0[0]])
-    return bytearray(out_arr)
+    return array('I', [0, 0, section_0[0]])
 
-def yaml_to_ksm(filename: str):
-    # main input file
-    with open(filename, 'r') as f:
-        input_file = yaml.safe_load(f)
+def modified_ksm_filename(filename: str) -> str:
+    if filename.endswith('.bin.yaml'):
+        return filename[:-len('.bin.yaml')] + '_modified.bin'
+    else:
+        return filename + '.bin'
+
+def yaml_to_ksm(filename: str, out_filename: str | None = None, intern_constants: bool = False, use_cache: bool = False,
+                timings: Timings | None = None):
+    program = load_ksm_program(filename, intern_constants, use_cache, timings)
     
-    assert isinstance(input_file, dict) and 'section_0' in input_file, "Input yaml file has to be a dictionary \
-        containing the properties 'section_0' and optionally 'tables' and 'definitions'."
+    with timed(timings, 'link'):
+        section_list = link_ksm(program)
+    
+    if out_filename is None:
+        out_filename = modified_ksm_filename(filename)
+    
+    with timed(timings, 'container write'):
+        write_ksm_file(out_filename, section_list)
+
+@dataclass
+class KsmProgram:
+    """A script parsed from its yaml files, everything but the layout of the code section is resolved."""
+    section_0: array[int]
+    definitions: list[FunctionDef]
+    static_variables: list[Var]
+    constants: list[Var]
+    imports: list[ScriptImport]
+    global_variables: list[Var]
+    tables: list[Table]
+    
+    # the yaml files it was parsed from, so reassembling it can find the functions that changed
+    sources: tuple[dict, dict] | None = field(default=None, repr=False, compare=False)
+
+def reusable_function_code(previous: KsmProgram | None, input_file: dict, var_input_file: dict,
+                           funcs: list[FunctionDef]) -> list[FunctionCode | None]:
+    # the code of the functions that are still the same as in the previous build, as long as nothing
+    # outside of them that their code refers to changed: the other yaml sections and variables, or any function's name
+    if previous is None or previous.sources is None:
+        return [None] * len(funcs)
     
-    # var input file
-    var_filename = filename[:-len('.yaml')] + '.variables.yaml'
+    previous_input_file, previous_var_input_file = previous.sources
+    keys = (input_file.keys() | previous_input_file.keys()) - {'definitions'}
     
-    with open(var_filename, 'r') as f:
-        var_input_file = yaml.safe_load(f)
+    if var_input_file != previous_var_input_file or any(input_file.get(key) != previous_input_file.get(key) for key in keys):
+        return [None] * len(funcs)
     
+    if [(fn.name, fn.id, fn.generated_from_thread) for fn in funcs] != \
+            [(fn.name, fn.id, fn.generated_from_thread) for fn in previous.definitions]:
+        return [None] * len(funcs)
+    
+    return [previous_fn.encoded if obj == previous_obj else None
+            for obj, previous_obj, previous_fn in zip(input_file.get('definitions', []), previous_input_file.get('definitions', []), previous.definitions)]
+
+def parse_ksm_program(input_file: dict, var_input_file: dict, intern_constants: bool = False,
+                      previous: KsmProgram | None = None) -> KsmProgram:
+    """Parses and assembles a script. Functions that didn't change since the previous build keep their code."""
+    assert isinstance(input_file, dict) and 'section_0' in input_file, "Input yaml file has to be a dictionary \
+        containing the properties 'section_0' and optionally 'tables' and 'definitions'."
     assert isinstance(var_input_file, dict), "Input variables yaml file has to be a dict."
     
-    sections: dict[int, bytearray] = {}
     symbol_ids = SymbolIds()
     
-    # write content
-    sections[0] = parse_section_0(input_file)
-    funcs, sections[1] = parse_function_definitions(input_file, symbol_ids)
-    static_vars, sections[2] = parse_variables(var_input_file, 'static_variables', VarCategory.Static, symbol_ids)
-    # TODO: tables
-    constants, sections[4] = parse_variables(var_input_file, 'constants', VarCategory.Const, symbol_ids)
-    sections[5] = parse_imports(input_file, symbol_ids)
-    globals, sections[6] = parse_variables(var_input_file, 'global_variables', VarCategory.Global, symbol_ids)
+    section_0 = parse_section_0(input_file)
+    funcs = parse_function_definitions(input_file, symbol_ids)
+    static_vars = parse_variables(var_input_file, 'static_variables', VarCategory.Static, symbol_ids)
+    constants = parse_variables(var_input_file, 'constants', VarCategory.Const, symbol_ids)
+    imports = parse_imports(input_file, symbol_ids)
+    globals = parse_variables(var_input_file, 'global_variables', VarCategory.Global, symbol_ids)
+    
+    add_temp_vars(symbol_ids)
+    
+    tables = tables_from_yaml(input_file)
+    for table in tables:
+        symbol_ids.add(table)
+    
+    constant_pool = ConstantPool(constants, intern_constants)
+    claimed: list[FunctionDef] = []
+    thread_functions = generated_thread_functions(funcs, claimed)
+    previous_code = reusable_function_code(previous, input_file, var_input_file, funcs)
+    definitions = {fn.id: fn for fn in funcs}
     
-    for fn in funcs:
+    for fn, code in zip(funcs, previous_code):
         assert fn.instruction_strs is not None
-        fn.instructions = [cmd_from_string(line, fn, constants, symbol_ids) for line in fn.instruction_strs]
+        fn_symbol_ids = function_symbol_ids(fn, symbol_ids)
+        
+        if code is not None:
+            # the reused code has to see the same constants and generated functions as when it was assembled
+            for data_type, value in code.interned_constants:
+                constant_pool.get(data_type, value)
+            
+            if not claim_thread_functions(fn, code, definitions, thread_functions):
+                return parse_ksm_program(input_file, var_input_file, intern_constants)
+        else:
+            constant_count = len(constants)
+            claimed.clear()
+            
+            fn.instructions = [cmd_from_string(line, fn, constant_pool, fn_symbol_ids, thread_functions) for line in fn.instruction_strs]
+            code = encode_function_code(fn)
+            code.claimed_functions = [func.id for func in claimed]
+            code.interned_constants = [(var.data_type, var.user_data) for var in constants[constant_count:]]
+            
+            # only the code is needed from here on
+            fn.instructions = None
+        
+        fn.encoded = code
+        
+        for table in fn.tables:
+            resolve_table_values(table, fn, constant_pool, fn_symbol_ids)
     
-    sections[7] = parse_function_implementations(funcs, symbol_ids)
+    for table in tables:
+        resolve_table_values(table, None, constant_pool, symbol_ids)
     
-    section_list = [sections.get(i, bytearray([0, 0, 0, 0])) for i in range(9)]
+    if previous is not None and intern_constants and any(code is not None for code in previous_code) and constants != previous.constants:
+        # the reused code refers to constants by id, which only stay the same if the same constants were added
+        return parse_ksm_program(input_file, var_input_file, intern_constants)
     
-    if filename.endswith('.bin.yaml'):
-        out_filename = filename[:-len('.bin.yaml')] + '_modified.bin'
+    return KsmProgram(section_0, funcs, static_vars, constants, imports, globals, tables, (input_file, var_input_file))
+
+def link_ksm(program: KsmProgram) -> list[array[int]]:
+    funcs = program.definitions
+    
+    # the offsets in the definitions and tables are only known once the code is laid out
+    code = parse_function_implementations(funcs, program.tables + [table for fn in funcs for table in fn.tables])
+    
+    return [
+        program.section_0,
+        write_function_definitions(funcs),
+        write_variable_defs(program.static_variables),
+        write_table_defs(program.tables),
+        write_variable_defs(program.constants),
+        write_imports(program.imports),
+        write_variable_defs(program.global_variables),
+        code,
+    ]
+
+def ksm_yaml_filenames(filename: str) -> list[str]:
+    # the main yaml file and its variables file
+    return [filename, filename[:-len('.yaml')] + '.variables.yaml']
+
+def load_ksm_program(filename: str, intern_constants: bool = False, use_cache: bool = False,
+                     timings: Timings | None = None) -> KsmProgram:
+    inputs = InputFiles(ksm_yaml_filenames(filename))
+    options = (intern_constants,)
+    
+    previous = None
+    
+    if use_cache:
+        with timed(timings, 'cache load'):
+            cached = load_cached(cache_filename(filename), inputs, options)
+        
+        if cached is not None:
+            previous, up_to_date = cached
+            
+            if up_to_date:
+                return previous
+    
+    with timed(timings, 'YAML load'):
+        input_file, var_input_file = [load_yaml(content) for content in inputs.contents]
+    
+    with timed(timings, 'assemble'):
+        # an outdated cache still has the code of the functions that didn't change
+        program = parse_ksm_program(input_file, var_input_file, intern_constants, previous)
+    
+    if use_cache:
+        # stored before linking, which fills in the offsets
+        with timed(timings, 'cache store'):
+            store_cached(cache_filename(filename), inputs, options, program)
+    
+    return program
+
+# batch mode
+def find_input_files(inputs: list[str]) -> list[tuple[str, str]]:
+    """Expands files, directories and glob patterns into (filename, path relative to its input) pairs."""
+    files: list[tuple[str, str]] = []
+    
+    for input in inputs:
+        if os.path.isdir(input):
+            for dirpath, dirnames, filenames in os.walk(input):
+                dirnames.sort()
+                
+                for name in sorted(filenames):
+                    # the output of reassembling (see modified_ksm_filename) isn't an input
+                    if name.endswith('.bin') and not name.endswith('_modified.bin'):
+                        path = os.path.join(dirpath, name)
+                        files.append((path, os.path.relpath(path, input)))
+        elif os.path.isfile(input):
+            files.append((input, os.path.basename(input)))
+        else:
+            matches = sorted(path for path in glob(input, recursive=True)
+                             if os.path.isfile(path) and not path.endswith('.variables.yaml'))
+            assert len(matches) > 0, f"No input files found matching {input!r}"
+            files.extend((path, os.path.basename(path)) for path in matches)
+    
+    return files
+
+@dataclass
+class ConvertOptions:
+    intern_constants: bool = False
+    function_names: list[str] | None = None
+    timings: bool = False
+    use_cache: bool = False
+
+def convert_file(filename: str, out_filename: str | None, options: ConvertOptions, timings: Timings | None = None) -> list[str]:
+    """Returns the names passed with -f that the file doesn't have (see ksm_to_yaml)."""
+    if filename.endswith('.bin'):
+        return ksm_to_yaml(filename, out_filename + '.yaml' if out_filename is not None else None,
+                           function_names=options.function_names, timings=timings)
+    elif filename.endswith('.yaml'):
+        yaml_to_ksm(filename, modified_ksm_filename(out_filename) if out_filename is not None else None,
+                    options.intern_constants, options.use_cache, timings)
+        return []
     else:
-        out_filename = filename + '.bin'
+        raise ValueError(f"Unknown file type of {filename} (expected .bin or .yaml)")
+
+def try_convert_file(filename: str, out_filename: str | None, options: ConvertOptions) -> tuple[str | None, Timings | None, list[str] | None]:
+    """Converts a single file, returning an error message instead of raising so one broken file doesn't stop a batch."""
+    timings = Timings() if options.timings else None
     
-    with open(out_filename, 'wb') as f:
-        f.write(write_ksm_container(section_list))
+    try:
+        missing_names = convert_file(filename, out_filename, options, timings)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}", timings, None
+    
+    return None, timings, missing_names
+
+def convert_files(files: list[tuple[str, str]], options: ConvertOptions, output_dir: str | None = None, jobs: int = 1) -> int:
+    start = perf_counter()
+    
+    filenames = [filename for filename, _ in files]
+    out_filenames: list[str | None] = []
+    
+    for _, relative_path in files:
+        if output_dir is not None:
+            out_filename = os.path.join(output_dir, relative_path)
+            os.makedirs(os.path.dirname(out_filename) or '.', exist_ok=True)
+            out_filenames.append(out_filename)
+        else:
+            out_filenames.append(None)
+    
+    timings = Timings()
+    failures = 0
+    
+    # a name passed with -f only has to be in one of the scripts
+    unknown_names: set[str] | None = None
+    
+    for filename, (error, file_timings, missing_names) in zip(filenames, map_jobs(try_convert_file, jobs, filenames, out_filenames, repeat(options))):
+        if file_timings is not None:
+            timings.merge(file_timings)
+        
+        if error is not None:
+            failures += 1
+            print(f"{filename}: {error}")
+        elif filename.endswith('.bin'):
+            unknown_names = set(missing_names) if unknown_names is None else unknown_names & set(missing_names)
+    
+    if unknown_names:
+        print(f"Unknown functions (not in any of the scripts): {', '.join(sorted(unknown_names))}")
+    
+    total_bytes = sum(os.path.getsize(filename) for filename in filenames)
+    elapsed = perf_counter() - start
+    
+    print(f"Processed {len(files)} files ({len(files) - failures} succeeded, {failures} failed) in {elapsed:.2f}s")
+    if elapsed > 0:
+        print(f"{len(files) / elapsed:.1f} files/s, {total_bytes / elapsed / 1_000_000:.2f} MB/s")
+    
+    if options.timings:
+        print_timings(timings, total_bytes)
+    
+    return failures + len(unknown_names or ())
+
+def map_jobs(function: Callable[..., T], jobs: int, *iterables: Iterable) -> Iterator[T]:
+    if jobs == 1:
+        yield from map(function, *iterables)
+    else:
+        # one file per task, results are reported in input order regardless of which worker finishes first
+        with ProcessPoolExecutor(jobs) as executor:
+            yield from executor.map(function, *iterables)
+
+def print_timings(timings: Timings, total_bytes: int):
+    # with several jobs, the stage times are summed over all worker processes
+    print(f"YAML loader: {YamlLoader.__name__}")
+    print(timings.report(total_bytes), end='')
+
+# round trip verification
+def compare_sections(original: list[memoryview], rebuilt: list[memoryview]) -> list[str]:
+    """Describes the first differing word of every section that doesn't match."""
+    differences: list[str] = []
+    
+    if len(original) != len(rebuilt):
+        differences.append(f"section count differs ({len(original)} != {len(rebuilt)})")
+    
+    for i, (section, rebuilt_section) in enumerate(zip(original, rebuilt)):
+        if section == rebuilt_section:
+            continue
+        
+        words, rebuilt_words = section.cast('I'), rebuilt_section.cast('I')
+        length = min(len(words), len(rebuilt_words))
+        offset = next((offset for offset in range(length) if words[offset] != rebuilt_words[offset]), length)
+        
+        if offset < length:
+            differences.append(f"section {i}: first difference at word 0x{offset:x} "
+                               f"(0x{words[offset]:08x} != 0x{rebuilt_words[offset]:08x})")
+        else:
+            differences.append(f"section {i}: length differs (0x{len(words):x} != 0x{len(rebuilt_words):x} words)")
+    
+    return differences
+
+def verify_file(filename: str, timings: Timings) -> list[str]:
+    """Disassembles and reassembles a file in memory, returning how the result differs from the original."""
+    with timings.stage('container read'):
+        sections = read_ksm_container(open_ksm_file(filename))
+    
+    out, var_out = io.StringIO(), io.StringIO()
+    
+    with timings.stage('YAML emit'):
+        write_ksm_yaml(sections, out, var_out, timings=timings)
+    
+    with timings.stage('YAML load'):
+        input_file = load_yaml(out.getvalue())
+        var_input_file = load_yaml(var_out.getvalue())
+    
+    with timings.stage('assemble'):
+        program = parse_ksm_program(input_file, var_input_file)
+    
+    with timings.stage('link'):
+        rebuilt_sections = link_ksm(program)
+    
+    with timings.stage('container write'):
+        container = write_ksm_container(rebuilt_sections)
+    
+    return compare_sections(sections, read_ksm_container(container))
+
+def try_verify_file(filename: str) -> tuple[list[str], Timings]:
+    timings = Timings()
+    
+    try:
+        differences = verify_file(filename, timings)
+    except Exception as e:
+        differences = [f"{type(e).__name__}: {e}"]
+    
+    return differences, timings
+
+def verify_files(files: list[tuple[str, str]], jobs: int = 1) -> int:
+    start = perf_counter()
+    
+    filenames = [filename for filename, _ in files]
+    timings = Timings()
+    mismatches = 0
+    
+    for filename, (differences, file_timings) in zip(filenames, map_jobs(try_verify_file, jobs, filenames)):
+        timings.merge(file_timings)
+        
+        if len(differences) > 0:
+            mismatches += 1
+            print(f"{filename}:")
+            
+            for difference in differences:
+                print(f"  {difference}")
+    
+    total_bytes = sum(os.path.getsize(filename) for filename in filenames)
+    elapsed = perf_counter() - start
+    
+    print(f"Verified {len(files)} files ({len(files) - mismatches} identical, {mismatches} differ) in {elapsed:.2f}s")
+    print_timings(timings, total_bytes)
+    
+    return mismatches
+
+# watch mode
+WATCH_INTERVAL = 0.25
+
+def rebuild_ksm(inputs: InputFiles, out_filename: str, intern_constants: bool, previous: KsmProgram | None,
+                timings: Timings | None = None) -> KsmProgram:
+    with timed(timings, 'YAML load'):
+        input_file, var_input_file = [load_yaml(content) for content in inputs.contents]
+    
+    with timed(timings, 'assemble'):
+        program = parse_ksm_program(input_file, var_input_file, intern_constants, previous)
+    
+    with timed(timings, 'link'):
+        section_list = link_ksm(program)
+    
+    with timed(timings, 'container write'):
+        write_ksm_file(out_filename, section_list)
+    
+    return program
+
+def watch_ksm_yaml(filename: str, options: ConvertOptions):
+    """Reassembles a script every time the contents of its yaml files change, until interrupted.
+    The previous build stays in memory, so only the functions that changed get assembled again."""
+    out_filename = modified_ksm_filename(filename)
+    previous: KsmProgram | None = None
+    stamps = None
+    digest = None
+    
+    print(f"Watching {' and '.join(ksm_yaml_filenames(filename))}, press Ctrl+C to stop")
+    
+    while True:
+        try:
+            inputs = InputFiles(ksm_yaml_filenames(filename))
+            changed = inputs.stamps != stamps
+            
+            # the contents are only read when a file was written, and only a change of the contents causes a rebuild
+            if changed:
+                new_digest = inputs.digest()
+                changed = new_digest != digest
+                stamps, digest = inputs.stamps, new_digest
+        except FileNotFoundError:
+            # editors that save by replacing the file can leave it missing for a moment
+            changed = False
+        
+        if changed:
+            timings = Timings() if options.timings else None
+            start = perf_counter()
+            
+            try:
+                program = rebuild_ksm(inputs, out_filename, options.intern_constants, previous, timings)
+            except Exception as e:
+                # the previous build is kept, so the next save can still reuse it
+                print(f"{filename}: {type(e).__name__}: {e}")
+            else:
+                reused = {id(fn.encoded) for fn in previous.definitions} if previous is not None else set()
+                assembled = sum(id(fn.encoded) not in reused for fn in program.definitions)
+                elapsed = perf_counter() - start
+                
+                print(f"Wrote {out_filename} in {elapsed * 1000:.0f}ms ({assembled} of {len(program.definitions)} functions assembled)")
+                previous = program
+            
+            if timings is not None:
+                print(timings.report(sum(size for _, _, size in stamps)), end='')
+        
+        sleep(WATCH_INTERVAL)
 
 def main():
-    if len(argv) == 1 or argv[1] == '--help' or argv[1] == '-h':
-        print("Sticker Star KSM Script Dumper")
-        print("Usage: main.py <input file.bin | input file.yaml>")
+    parser = ArgumentParser(description="Sticker Star KSM Script Dumper")
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help="input file.bin or input file.yaml; directories and glob patterns are processed in batch. "
+                             "'verify <input...>' disassembles and reassembles .bin files in memory and compares them to the original")
+    parser.add_argument('-o', '--output-dir', help="write output files to this directory instead of next to the input")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes used in batch mode (0 uses all CPU cores)")
+    parser.add_argument('--intern-constants', action='store_true',
+                        help="when reassembling, add literals that have no matching constant to the constants section")
+    parser.add_argument('-f', '--function', action='append', dest='function_names', metavar='NAME',
+                        help="only disassemble this function and the functions it references (can be repeated)")
+    parser.add_argument('--cache', action='store_true', dest='use_cache',
+                        help="when reassembling, keep the parsed script in a .cache file next to the yaml file and reuse it while both yaml files are unchanged")
+    parser.add_argument('--timings', action='store_true',
+                        help="print the time spent in each stage of the conversion and which YAML loader was used")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and reassemble the input .yaml file every time it or its variables file changes")
+    
+    args = parser.parse_args()
+    options = ConvertOptions(args.intern_constants, args.function_names, args.timings, args.use_cache)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    
+    if args.inputs[0] == 'verify' and len(args.inputs) > 1:
+        if verify_files(find_input_files(args.inputs[1:]), jobs) > 0:
+            sys.exit(1)
         return
     
-    filename = argv[1]
+    if args.watch:
+        assert len(args.inputs) == 1 and args.inputs[0].endswith('.yaml') and os.path.isfile(args.inputs[0]), \
+            "--watch takes a single .yaml file"
+        
+        try:
+            watch_ksm_yaml(args.inputs[0], options)
+        except KeyboardInterrupt:
+            pass
+        return
     
-    if filename.endswith('.bin'):
-        ksm_to_yaml(filename)
-    elif filename.endswith('.yaml'):
-        yaml_to_ksm(filename)
+    files = find_input_files(args.inputs)
+    
+    if len(files) == 1 and len(args.inputs) == 1 and os.path.isfile(args.inputs[0]) and args.output_dir is None:
+        timings = Timings() if args.timings else None
+        missing_names = convert_file(files[0][0], None, options, timings)
+        
+        if timings is not None:
+            print_timings(timings, os.path.getsize(files[0][0]))
+        
+        if len(missing_names) > 0:
+            parser.error(f"unknown function: {', '.join(missing_names)}")
+        return
+    
+    if convert_files(files, options, args.output_dir, jobs) > 0:
+        sys.exit(1)
 
 if __name__ ==  '__main__':
     main()
@@ -1,7 +1,9 @@
 from array import array
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from enum import Enum
 from itertools import chain
+from operator import length_hint
+from typing import Iterator
 
 import cmds
 import functions
@@ -20,15 +22,15 @@ class ImportType(Enum):
     Unk2 = 5
     Func = 7
 
-@dataclass
+@dataclass(slots=True)
 class ScriptImport:
     name: str | None
     field_0x4: int # short
     type: ImportType
     id: int
 
-def read_function_imports(section: bytes) -> list[ScriptImport]:
-    arr = enumerate(array('I', section))
+def read_function_imports(section: memoryview) -> list[ScriptImport]:
+    arr = enumerate(section.cast('I'))
     
     count = next(arr)[1]
     imports = []
@@ -96,9 +98,9 @@ def function_import_from_yaml(obj: dict) -> ScriptImport:
     
     return ScriptImport(name, field_0x4, type, id)
 
-def parse_imports(input_file: dict, symbol_ids: SymbolIds) -> bytearray:
+def parse_imports(input_file: dict, symbol_ids: SymbolIds) -> list[ScriptImport]:
     if 'imports' not in input_file:
-        return bytearray([0, 0, 0, 0])
+        return []
     
     assert isinstance(input_file['imports'], list), "Script imports have to be a list"
     
@@ -107,29 +109,34 @@ def parse_imports(input_file: dict, symbol_ids: SymbolIds) -> bytearray:
         assert isinstance(obj, dict), "Script import has to be an object"
         imports.append(function_import_from_yaml(obj))
     
+    for fn in imports:
+        symbol_ids.add(fn)
+    
+    return imports
+
+def write_imports(imports: list[ScriptImport]) -> array[int]:
     out = array('I', [len(imports)])
     
     for fn in imports:
-        symbol_ids.add(fn)
         out.extend(write_import(fn))
     
-    return bytearray(out)
+    return out
 
 # labels
-@dataclass
+@dataclass(slots=True)
 class Label:
     name: str | None
     alias: str | None
     id: int
     code_offset: int
 
-def read_label(arr: enumerate[int], section: bytes) -> Label:
+def read_label(arr: enumerate[int], section: memoryview) -> Label:
     offset, value = next(arr)
     id = next(arr)[1]
     code_offset = next(arr)[1]
     
     if value == 0xFFFFFFFF:
-        name = read_string(section, offset + 6)
+        name = read_string(section, offset + 4)
         
         for _ in range(next(arr)[1]):
             next(arr)
@@ -152,55 +159,143 @@ def print_label(label: Label) -> str:
     
     return out_str
 
+def label_from_yaml(obj: dict) -> Label:
+    assert isinstance(obj, dict), "Label has to be an object"
+    
+    name = obj.get('name')
+    assert name is None or isinstance(name, str), "Label name has to be a string"
+    
+    alias = obj.get('alias')
+    assert alias is None or isinstance(alias, str), "Label alias has to be a string"
+    
+    assert 'id' in obj and isinstance(obj['id'], int), "Label id (required) has to be an integer"
+    id = obj['id']
+    
+    assert 'code_offset' in obj and isinstance(obj['code_offset'], int), "Label code_offset (required) has to be an integer"
+    code_offset = obj['code_offset']
+    
+    return Label(name, alias, id, code_offset)
+
+def write_label(label: Label) -> array[int]:
+    out = array('I')
+    
+    out.append(0xFFFFFFFF if label.name is not None else 0)
+    out.append(label.id)
+    out.append(label.code_offset)
+    
+    if label.name is not None:
+        out.extend(write_string(label.name))
+    
+    return out
+
 # script expressions
-@dataclass
+@dataclass(slots=True)
 class ExprSymbol:
     label: str
+    opcode: int
 
-EXPR_SYMBOLS = {
-    0x3f: ExprSymbol('next_function'),
-    0x41: ExprSymbol('('),
-    0x42: ExprSymbol(')'),
-    0x43: ExprSymbol('||'),
-    0x44: ExprSymbol('&&'),
-    
-    0x45: ExprSymbol('|'),
-    0x46: ExprSymbol('&'),
-    0x47: ExprSymbol('^'),
-    0x48: ExprSymbol('<<'),
-    0x49: ExprSymbol('>>'),
-    
-    0x4a: ExprSymbol('=='),
-    0x4b: ExprSymbol('!='),
-    0x4c: ExprSymbol('>'),
-    0x4d: ExprSymbol('<'),
-    0x4e: ExprSymbol('>='),
-    0x4f: ExprSymbol('<='),
-    
-    0x52: ExprSymbol('%'),
-    0x53: ExprSymbol('+'),
-    0x54: ExprSymbol('-'),
-    0x55: ExprSymbol('*'),
-    0x56: ExprSymbol('/'),
-}
+EXPR_SYMBOLS = {symbol.opcode: symbol for symbol in [
+    ExprSymbol('next_function', 0x3f),
+    ExprSymbol('(', 0x41),
+    ExprSymbol(')', 0x42),
+    ExprSymbol('||', 0x43),
+    ExprSymbol('&&', 0x44),
+    
+    ExprSymbol('|', 0x45),
+    ExprSymbol('&', 0x46),
+    ExprSymbol('^', 0x47),
+    ExprSymbol('<<', 0x48),
+    ExprSymbol('>>', 0x49),
+    
+    ExprSymbol('==', 0x4a),
+    ExprSymbol('!=', 0x4b),
+    ExprSymbol('>', 0x4c),
+    ExprSymbol('<', 0x4d),
+    ExprSymbol('>=', 0x4e),
+    ExprSymbol('<=', 0x4f),
+    
+    ExprSymbol('%', 0x52),
+    ExprSymbol('+', 0x53),
+    ExprSymbol('-', 0x54),
+    ExprSymbol('*', 0x55),
+    ExprSymbol('/', 0x56),
+]}
+EXPR_SYMBOLS_BY_LABEL = {symbol.label: symbol for symbol in EXPR_SYMBOLS.values()}
 
 type ExprValue = functions.FunctionDef | ScriptImport | Var | cmds.CallCmd | ExprSymbol | int
 
-@dataclass
 class Expr:
-    elements: list[ExprValue] = field(default_factory=lambda: [])
+    """
+    Expression elements are either given directly (when parsed from text) or, when decoded from a binary,
+    kept as the range of their words in the function's code and resolved with the symbols of their scope once they're used.
+    """
+    __slots__ = ('_elements', 'code', 'start', 'end', 'symbol_ids')
+    __match_args__ = ('elements',)
+    
+    def __init__(self, elements: list[ExprValue] | None = None, *, code: array[int] | memoryview | None = None, start: int = 0, end: int = 0,
+                 symbol_ids: SymbolIds | None = None):
+        self._elements = elements
+        self.code = code
+        self.start = start
+        self.end = end
+        self.symbol_ids = symbol_ids
+    
+    @property
+    def elements(self) -> list[ExprValue]:
+        if self._elements is None:
+            if self.code is None or self.symbol_ids is None:
+                self._elements = []
+            else:
+                self._elements = read_expr_elements(iter(self.code[self.start:self.end]), self.symbol_ids)
+            
+            # the words aren't needed anymore once they're resolved
+            self.code = None
+            self.symbol_ids = None
+        
+        return self._elements
+    
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Expr) and self.elements == other.elements
+    
+    def __repr__(self) -> str:
+        return f"Expr({self.elements!r})"
 
-def read_expr(initial_element: int | None, arr: enumerate[int], symbol_ids: SymbolIds, raise_on_ending_sequence = False) -> Expr:
-    elements = []
+def skip_expr_words(initial_element: int, arr: Iterator[int]):
+    # skips an expression, including its terminator and any calls nested inside of it
+    for value in chain([initial_element], arr):
+        if value == 0x40:
+            break
+        
+        if value == 0xc:
+            next(arr)
+            
+            for arg in arr:
+                if arg == 0x11:
+                    break
+                
+                skip_expr_words(arg, arr)
+
+def read_expr(initial_element: int | None, arr: Iterator[int], symbol_ids: SymbolIds, code: array[int] | memoryview | None) -> Expr:
+    if code is None:
+        # nested in an expression that is being resolved right now
+        return Expr(read_expr_elements(chain([initial_element], arr) if initial_element is not None else arr, symbol_ids))
     
-    values = chain([(0, initial_element)], arr) if initial_element is not None else arr
+    # symbols are only resolved once the expression is used, in the scope it was read in.
+    # arr iterates over a copy of the code, so the words that are left in it give the position
+    start = len(code) - length_hint(arr) - (1 if initial_element is not None else 0)
+    skip_expr_words(initial_element if initial_element is not None else next(arr), arr)
     
-    for _, value in values:
+    return Expr(code=code, start=start, end=len(code) - length_hint(arr), symbol_ids=symbol_ids.snapshot())
+
+def read_expr_elements(arr: Iterator[int], symbol_ids: SymbolIds) -> list[ExprValue]:
+    elements = []
+    
+    for value in arr:
         if value == 0x40:
             break
         
         if value == 0xc:
-            elements.append(cmds.read_call_cmd(arr, symbol_ids, cmds.ReadCmdOptions(0xc, False)))
+            elements.append(cmds.read_call_cmd(arr, symbol_ids, cmds.NESTED_CALL_OPTIONS))
             continue
         
         if value in EXPR_SYMBOLS:
@@ -209,25 +304,24 @@ def read_expr(initial_element: int | None, arr: enumerate[int], symbol_ids: Symb
             var = symbol_ids.get(value)
         elements.append(var)
     
-    return Expr(elements)
+    return elements
 
-def write_expr_or_var(value: Expr | Var | int, out: array[int]):
-    if isinstance(value, Var):
-        out.append(value.id)
-        return
+def write_expr_or_var(value: 'Expr | Var | Label | Table | ScriptImport | functions.FunctionDef | int', out: array[int]):
     if isinstance(value, int):
         out.append(value)
         return
+    if not isinstance(value, Expr):
+        out.append(value.id)
+        return
     
     for element in value.elements:
         match element:
-            case Var() | ScriptImport():
+            case Var() | ScriptImport() | functions.FunctionDef() | Label() | Table():
                 out.append(element.id)
             case cmds.CallCmd():
                 cmds.write_call_cmd(element, out)
-            case ExprSymbol():
-                id = next(key for key, val in EXPR_SYMBOLS.items() if val == element)
-                out.append(id)
+            case ExprSymbol(opcode=opcode):
+                out.append(opcode)
             case int(x):
                 out.append(x)
             case default:
@@ -0,0 +1,154 @@
+#!/bin/env python3
+from argparse import ArgumentParser
+import os
+
+from main import yaml_to_ksm
+
+# synthetic scripts for round trip checks and benchmarks. They're written as yaml and assembled,
+# so they only contain what the assembler supports, laid out the way it lays out code
+
+SAMPLE_VARIABLES = """static_variables:
+  - {name: s_counter, id: 0x20000001, type: Int}
+  - {id: 0x20000002, type: Int, content: 7}
+
+constants:
+  - {id: 0x30000001, type: Int, content: 5}
+  - {id: 0x30000002, type: String, content: 'hi there'}
+  - {id: 0x30000003, type: Float, content: 1.5}
+  - {id: 0x30000004, type: Int, content: 2}
+  - {id: 0x30000005, type: Int, content: -1}
+
+global_variables:
+  - {name: g_flag, id: 0x40000001, type: Int}
+  - {name: 'g_odd, {name}: #1 ''x''', id: 0x40000002, type: Int}
+"""
+
+SAMPLE_HEADER = """section_0:
+  - 0xabc
+
+imports:
+  - { id: 0x50000001, name: 'evt_print', field_0x4: 3, type: Func }
+
+tables:
+  - name: tbl_values
+    id: 0x90000001
+    data_type: Int
+    datatype2: 0x3
+    length: 0x3
+    start_offset: 0x0
+    values: [10, 20, 30]
+  - name: tbl_refs
+    id: 0x90000002
+    data_type: Var
+    datatype2: 0x3
+    length: 0x9
+    start_offset: 0x0
+    values: [Static:s_counter, Static:0x20000002, Global:g_flag, TempVar:1, 5`, -1`, 1.5`, "'hi there'", 0x1234]
+
+definitions:
+"""
+
+# a bit of everything: expressions with nested calls, every kind of jump, unused words that aren't 0 and a named and an unnamed label
+SAMPLE_BLOCK = """      - Set   TempVar:0 ( 5` + ( 2` * 5` ) )
+      - Set   TempVar:2 ( TempVar:0 * -1` )
+      - Set   TempVar:3 ( TempVar:2 + -5` )
+      - Call  evt_print ( 'hi there', Call evt_print ( 5` ) )
+      - Call* evt_print ( 'hi there', TempVar:0 )
+      - If TempVar:0 == 5`
+      -     Wait* 2`
+      - ElseIf TempVar:0 == 2`
+      -     Wait* 5`
+      - Else
+      -     DeleteRuntime TempVar:1
+      - EndIf
+      - If TempVar:0 == 2` Unused ( 0x1, 0xffffffff )
+      -     WaitWhile TempVar:0 < 5` Unused ( 0x0, 0x3 )
+      - ElseIf TempVar:0 == 5` Unused ( 0x2, 0x0, 0x4 )
+      - EndIf
+      - Switch TempVar:0 Unused ( 0x7 )
+      -     Case* == 5`
+      -     BreakSwitch
+      -     Case* == 2`
+      -     BreakSwitch
+      - EndSwitch
+      - While Static:s_counter < 5`
+      -     Break
+      - EndWhile
+      - GotoLabel label:loop
+      - GotoLabel label:a
+"""
+
+def print_sample_function(index: int, blocks: int) -> str:
+    id = 0x60010000 + 2 * index
+    
+    return f"""  - name: evt_sample_{index}
+    id: 0x{id:x}
+    is_public: 1
+    field_0xc: 0x0
+    return_var: LocalVar:loc_a
+    field_0x34: 0x0
+
+    variables:
+      - name: loc_a
+        id: 0x70000100
+        type: Int
+
+    labels:
+      - name: loop
+        id: 0x{0x80010000 + 2 * index:x}
+        code_offset: 0x0
+      - alias: a
+        id: 0x{0x80010001 + 2 * index:x}
+        code_offset: 0x0
+
+    body:
+      - GetArgs fn:self ( LocalVar:loc_a )
+      - Label loop
+      - Label a
+{SAMPLE_BLOCK * blocks}      - Thread1 "evt_sample_{index}_thread" Capture ( TempVar:1 as 0x10000100 )
+      -     Wait 5`
+      - Return
+      - ReadTableLength ( table:tbl_values )
+      - Return
+
+  - name: _evt_sample_{index}_thread_1
+    id: 0x{id + 1:x}
+    is_public: 1
+    field_0xc: 0x0
+    return_var: 0x70000100
+    field_0x34: 0x0
+
+    generated_from_thread: true
+
+"""
+
+def write_sample(directory: str, name: str, functions: int, blocks: int) -> str:
+    """Writes the yaml files of a sample script and assembles them, returns the filename of the .bin file."""
+    filename = os.path.join(directory, name + '.bin')
+    
+    with open(filename + '.yaml', 'w', encoding='utf-8') as f:
+        f.write(SAMPLE_HEADER)
+        f.writelines(print_sample_function(i, blocks) for i in range(functions))
+    
+    with open(filename + '.variables.yaml', 'w', encoding='utf-8') as f:
+        f.write(SAMPLE_VARIABLES)
+    
+    # -5` isn't one of the constants, so it gets added to them
+    yaml_to_ksm(filename + '.yaml', filename, intern_constants=True)
+    
+    return filename
+
+def main():
+    parser = ArgumentParser(description="Writes synthetic KSM scripts to check round trips with 'main.py verify' and to benchmark with")
+    parser.add_argument('directory')
+    parser.add_argument('--functions', type=int, default=500, help="functions in the large sample")
+    parser.add_argument('--blocks', type=int, default=3, help="repetitions of the sample block in every function of the large sample")
+    
+    args = parser.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+    
+    print(write_sample(args.directory, 'small', 2, 1))
+    print(write_sample(args.directory, 'large', args.functions, args.blocks))
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 from array import array
 from dataclasses import dataclass
 from enum import Enum
+from typing import Iterator
 
-from util import SymbolIds, read_string
+from util import SymbolIds, Timings, print_float, read_string, timed, write_string
 from variables import Var, VarCategory
 
 class TableDataType(Enum):
@@ -11,7 +12,7 @@ class TableDataType(Enum):
     Float = 2
     Byte = 3
 
-@dataclass
+@dataclass(slots=True)
 class Table:
     name: str | None
     id: int
@@ -21,36 +22,36 @@ class Table:
     datatype2: int
     values: list
 
-def read_table_values(section: bytes, tables: list[Table], symbol_ids: SymbolIds) -> list[Table]:
+def read_table_values(section: memoryview, tables: list[Table], symbol_ids: SymbolIds) -> list[Table]:
     for table in tables:
         # ?? 
-        table.datatype2 = array('I', section[table.start_offset * 4 : table.start_offset * 4 + 4])[0]
+        table.datatype2 = section[table.start_offset * 4 : table.start_offset * 4 + 4].cast('I')[0]
         
         start = (table.start_offset * 4) + 4
         match table.data_type:
             case TableDataType.Var:
                 end = start + (table.length * 4)
                 section_slice = section[start : end]
-                arr = enumerate(array('I', section_slice))
+                arr = enumerate(section_slice.cast('I'))
                 for _, val in arr:
                     val = symbol_ids.get(val)
                     table.values.append(val)
             case TableDataType.Int:
                 end = start + (table.length * 4)
                 section_slice = section[start : end]
-                arr = enumerate(array('I', section_slice))
+                arr = enumerate(section_slice.cast('I'))
                 for _, val in arr:
                     table.values.append(val)
             case TableDataType.Float:
                 end = start + (table.length * 4)
                 section_slice = section[start : end]
-                arr = enumerate(array('f', section_slice))
+                arr = enumerate(section_slice.cast('f'))
                 for _, val in arr:
                     table.values.append(val)
             case TableDataType.Byte:
                 end = start + table.length
                 section_slice = section[start : end]
-                arr = enumerate(array('B', section_slice))
+                arr = enumerate(section_slice)
                 for _, val in arr:
                     table.values.append(val)
             case _:
@@ -58,7 +59,7 @@ def read_table_values(section: bytes, tables: list[Table], symbol_ids: SymbolIds
     
     return tables
 
-def read_table(arr: enumerate[int], section: bytes):
+def read_table(arr: enumerate[int], section: memoryview):
     offset, value = next(arr)
     id = next(arr)[1]
     type_int = next(arr)[1]
@@ -78,8 +79,83 @@ def read_table(arr: enumerate[int], section: bytes):
     
     return Table(name, id, data_type, length, start_offset, 0, [])
 
-def read_table_defs(section: bytes, code_section: bytes, symbol_ids: SymbolIds) -> list[Table]:
-    arr = enumerate(array('I', section))
+def table_from_yaml(obj: dict) -> Table:
+    assert isinstance(obj, dict), "Table has to be an object"
+    
+    name = obj.get('name')
+    assert name is None or isinstance(name, str), "Table name has to be a string"
+    
+    assert 'id' in obj and isinstance(obj['id'], int), "Table id (required) has to be an integer"
+    id = obj['id']
+    
+    assert 'data_type' in obj and obj['data_type'] in TableDataType.__members__, \
+        f"Table data_type (required) has to be one of {', '.join(TableDataType.__members__)}"
+    data_type = TableDataType[obj['data_type']]
+    
+    assert 'length' in obj and isinstance(obj['length'], int), "Table length (required) has to be an integer"
+    length = obj['length']
+    
+    assert 'start_offset' in obj and isinstance(obj['start_offset'], int), "Table start_offset (required) has to be an integer"
+    start_offset = obj['start_offset']
+    
+    datatype2 = obj.get('datatype2', 0)
+    assert isinstance(datatype2, int), "Table datatype2 has to be an integer"
+    
+    # values of Var tables are still in their text form here
+    values = obj.get('values') or []
+    assert isinstance(values, list), "Table values have to be a list"
+    
+    return Table(name, id, data_type, length, start_offset, datatype2, values)
+
+def tables_from_yaml(input_file: dict) -> list[Table]:
+    if 'tables' not in input_file or input_file['tables'] is None:
+        return []
+    
+    assert isinstance(input_file['tables'], list), "Tables have to be a list"
+    return [table_from_yaml(obj) for obj in input_file['tables']]
+
+def write_table(table: Table) -> array[int]:
+    out = array('I')
+    
+    out.append(0xFFFFFFFF if table.name is not None else 0)
+    out.append(table.id)
+    out.append(table.data_type.value)
+    out.append(table.length)
+    out.append(table.start_offset)
+    
+    if table.name is not None:
+        out.extend(write_string(table.name))
+    
+    return out
+
+def write_table_values(table: Table, out: array[int]):
+    # the values get placed at the current end of the code section
+    table.start_offset = len(out)
+    table.length = len(table.values)
+    out.append(table.datatype2)
+    
+    match table.data_type:
+        case TableDataType.Var:
+            out.extend(val if isinstance(val, int) else val.id for val in table.values)
+        case TableDataType.Int:
+            out.extend(val & 0xFFFFFFFF for val in table.values)
+        case TableDataType.Float:
+            out.frombytes(array('f', table.values).tobytes())
+        case TableDataType.Byte:
+            data = bytes(table.values)
+            out.frombytes(data + bytes(-len(data) % 4))
+
+def write_table_defs(tables: list[Table]) -> array[int]:
+    out = array('I')
+    out.append(len(tables))
+    
+    for table in tables:
+        out.extend(write_table(table))
+    
+    return out
+
+def read_table_defs(section: memoryview, code_section: memoryview, symbol_ids: SymbolIds) -> list[Table]:
+    arr = enumerate(section.cast('I'))
     
     count = next(arr)[1]
     tables = []
@@ -98,14 +174,32 @@ def print_var(var: Var):
     elif var.alias is not None:
         return f"{var.category.name}:{var.alias}"
     elif var.category == VarCategory.Const and var.user_data is not None:
-        return f"{var.user_data}`" if isinstance(var.user_data, int) else repr(var.user_data)
+        return f"{var.user_data}`" if isinstance(var.user_data, (int, float)) else repr(var.user_data)
     else:
         return f"{var.category.name}:{hex(var.id)}"
 
 
-def print_table(table: Table, indentation_level: int = 1) -> str:
+TABLE_VALUES_PER_LINE = 16
+
+def print_table_value(val) -> str:
+    match val:
+        case Var():
+            value = print_var(val)
+            
+            if value[0] in '\'"':
+                # string constants have to stay quoted after loading, so they can be told apart from references
+                return f"'{value.replace("'", "''")}'"
+            
+            return value
+        case int():
+            return str(val)
+        case _:
+            # other symbols are kept as their id
+            return str(val.id)
+
+def print_table(table: Table, indentation_level: int = 1) -> Iterator[str]:
     indent = '  ' * indentation_level
-    text = f"""{indent}- name: {table.name}
+    yield f"""{indent}- name: {table.name if table.name is not None else 'null'}
 {indent}  id: {hex(table.id)}
 {indent}  data_type: {table.data_type.name}
 {indent}  datatype2: {hex(table.datatype2)} # ?
@@ -113,25 +207,30 @@ def print_table(table: Table, indentation_level: int = 1) -> str:
 {indent}  start_offset: {hex(table.start_offset)}\n"""
 
     if table.values is not None and len(table.values) > 0:
-        text += f"{indent}  values:\n"
+        # flow style, a row of values per line
+        match table.data_type:
+            case TableDataType.Int | TableDataType.Byte:
+                texts = list(map(str, table.values))
+            case TableDataType.Float:
+                texts = list(map(print_float, table.values))
+            case _:
+                texts = list(map(print_table_value, table.values))
         
-        for val in table.values:
-            text += f"{indent}    - {print_var(val) if isinstance(val, Var) else val}\n"
-    
-    return text
-
+        rows = (', '.join(texts[start:start + TABLE_VALUES_PER_LINE]) for start in range(0, len(texts), TABLE_VALUES_PER_LINE))
+        separator = f",\n{indent}    "
+        yield f"{indent}  values: [{separator.join(rows)}]\n"
 
-def print_tables(sections: list[bytes], symbol_ids: SymbolIds) -> str:
+def print_tables(sections: list[memoryview], symbol_ids: SymbolIds, timings: Timings | None = None) -> Iterator[str]:
     # section 3
-    tables = read_table_defs(sections[3], sections[7], symbol_ids)
+    with timed(timings, 'section decode'):
+        tables = read_table_defs(sections[3], sections[7], symbol_ids)
         
     if len(tables) == 0:
-        return ''
+        return
     
-    out_str = '\ntables:'
+    yield '\ntables:'
 
     for table in tables:
         symbol_ids.add(table)
-        out_str += '\n' + print_table(table)
-    
-    return out_str
+        yield '\n'
+        yield from print_table(table)
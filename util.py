@@ -1,11 +1,20 @@
 from array import array
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from enum import Enum
 from math import ceil
-from typing import Any
+import re
+from time import perf_counter
+from typing import Any, Iterator
 
-def read_string(section: bytes, offset_words: int) -> str:
-    buffer = section[offset_words * 4:]
-    bytelen = buffer.index(0)
-    return str(buffer[:bytelen], 'utf-8')
+NUL_TERMINATOR = re.compile(b'\0')
+
+def read_string(section: memoryview, offset_words: int) -> str:
+    # search for the terminator in place instead of copying the rest of the section
+    start = offset_words * 4
+    terminator = NUL_TERMINATOR.search(section, start)
+    assert terminator is not None, f"String at offset 0x{offset_words:x} is not null terminated"
+    
+    return str(section[start:terminator.start()], 'utf-8')
 
 def write_string(value: str) -> array[int]:
     int_len = ceil((len(value) + 1) / 4)
@@ -16,11 +25,50 @@ def write_string(value: str) -> array[int]:
     out.extend(array('I', name_bytes))
     return out
 
+def index_keys(value) -> list[tuple]:
+    # symbols can be looked up by (type, name) and, for variables, by (category, name)
+    # aliases share the namespace of names as they are printed in place of missing names
+    keys = []
+    category = getattr(value, 'category', None)
+    
+    for name in (getattr(value, 'name', None), getattr(value, 'alias', None)):
+        if name is not None:
+            keys.append((type(value), name))
+            
+            if category is not None:
+                keys.append((category, name))
+    
+    return keys
+
+def print_float(value: float) -> str:
+    # YAML only reads numbers with a dot as floats, and has its own names for infinity and NaN
+    if value != value:
+        return '.nan'
+    elif value in (float('inf'), float('-inf')):
+        return '.inf' if value > 0 else '-.inf'
+    
+    text = repr(value)
+    
+    if '.' not in text:
+        mantissa, e, exponent = text.partition('e')
+        text = f"{mantissa}.0{e}{exponent}"
+    
+    return text
+
 class SymbolIds:
     layers: list[dict]
+    indexes: list[dict]
+    base_depth: int
     
-    def __init__(self, *, layers: list[dict] | None = None):
+    def __init__(self, *, layers: list[dict] | None = None, indexes: list[dict] | None = None, base_depth: int = 1):
         self.layers = layers if layers is not None else [{}]
+        self.base_depth = base_depth
+        self.current_snapshot: SymbolIds | None = None
+        
+        if indexes is not None:
+            self.indexes = indexes
+        else:
+            self.indexes = [{key: value for value in layer.values() for key in index_keys(value)} for layer in self.layers]
     
     def get(self, id: int) -> Any:
         for layer in reversed(self.layers):
@@ -29,23 +77,111 @@ class SymbolIds:
         
         return id
     
+    def get_by_name(self, name: str, kinds: type | tuple[type, ...]) -> Any | None:
+        if not isinstance(kinds, tuple):
+            kinds = (kinds,)
+        
+        for index in reversed(self.indexes):
+            for kind in kinds:
+                if (kind, name) in index:
+                    return index[kind, name]
+        
+        return None
+    
+    def get_var(self, category: Enum, name: str) -> Any | None:
+        for index in reversed(self.indexes):
+            if (category, name) in index:
+                return index[category, name]
+        
+        return None
+    
     def add(self, value, *, id = None):
-        self.layers[-1][id if id is not None else value.id] = value
+        id = id if id is not None else value.id
+        layer, index = self.layers[-1], self.indexes[-1]
+        
+        if id in layer:
+            previous = layer[id]
+            
+            for key in index_keys(previous):
+                if index.get(key) is previous:
+                    del index[key]
+        
+        layer[id] = value
+        
+        for key in index_keys(value):
+            index[key] = value
+        
+        self.current_snapshot = None
     
     def push(self):
         self.layers.append({})
+        self.indexes.append({})
+        self.current_snapshot = None
     
     def pop(self):
-        if len(self.layers) > 1:
+        if len(self.layers) > self.base_depth:
             self.layers.pop()
+            self.indexes.pop()
+            self.current_snapshot = None
     
-    def copy(self):
-        return SymbolIds(layers=[layer.copy() for layer in self.layers])
+    def snapshot(self) -> 'SymbolIds':
+        # the symbols that are visible right now, unaffected by later pushes, pops and additions.
+        # only the current layer is copied, as the ones below it are only added to before a scope is
+        # opened on top of them. It's shared until the symbols change, so taking one is usually free
+        if self.current_snapshot is None:
+            layers = self.layers[:-1] + [self.layers[-1].copy()]
+            indexes = self.indexes[:-1] + [self.indexes[-1].copy()]
+            self.current_snapshot = SymbolIds(layers=layers, indexes=indexes, base_depth=len(layers))
+        
+        return self.current_snapshot
     
-    def flat(self) -> dict:
-        out = dict()
+    def overlay(self) -> 'SymbolIds':
+        # the layers of this table are shared, not copied, so creating a scope
+        # for a function's local symbols doesn't depend on the amount of global symbols.
+        # pop never removes the new local layer, so adding can't leak into the shared layers
+        layers = self.layers + [{}]
+        indexes = self.indexes + [{}]
+        return SymbolIds(layers=layers, indexes=indexes, base_depth=len(layers))
+
+class Timings:
+    """Total time spent in named stages. Time spent in a nested stage only counts towards that stage."""
+    totals: dict[str, float]
+    
+    def __init__(self):
+        self.totals = {}
+        self.nested: list[float] = []
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        self.nested.append(0.0)
+        
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.totals[name] = self.totals.get(name, 0.0) + elapsed - self.nested.pop()
+            
+            if len(self.nested) > 0:
+                self.nested[-1] += elapsed
+    
+    def merge(self, other: 'Timings'):
+        for name, seconds in other.totals.items():
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+    
+    def report(self, total_bytes: int) -> str:
+        total = sum(self.totals.values())
+        out_str = ''
         
-        for layer in self.layers:
-            out = out | layer
+        for name, seconds in self.totals.items():
+            out_str += f"  {name:<16}{seconds:8.3f}s {seconds / total * 100 if total > 0 else 0:5.1f}%"
+            
+            if seconds > 0:
+                out_str += f" {total_bytes / seconds / 1_000_000:9.2f} MB/s"
+            
+            out_str += '\n'
         
-        return out
+        return out_str
+
+def timed(timings: Timings | None, name: str) -> AbstractContextManager:
+    return timings.stage(name) if timings is not None else nullcontext()
@@ -3,11 +3,10 @@ from ctypes import c_int
 from dataclasses import dataclass
 from enum import Enum
 import struct
-from sys import argv
 from types import NoneType
-from typing import Any
+from typing import Any, TextIO
 
-from util import SymbolIds, read_string, write_string
+from util import SymbolIds, Timings, print_float, read_string, timed, write_string
 
 class VarCategory(Enum):
     # script binary scope
@@ -32,7 +31,7 @@ VAR_TYPE_NAMES = {
     0xe: 'Uninitialized',
 }
 
-@dataclass
+@dataclass(slots=True)
 class Var:
     name: str | None
     alias: str | None
@@ -43,7 +42,7 @@ class Var:
     flags: int
     user_data: int | str
 
-def read_variable(arr: enumerate[int], section: bytes, category: VarCategory) -> Var:
+def read_variable(arr: enumerate[int], section: memoryview, category: VarCategory) -> Var:
     offset, value = next(arr)
     id = next(arr)[1]
     raw_status = next(arr)[1]
@@ -80,8 +79,8 @@ def read_variable(arr: enumerate[int], section: bytes, category: VarCategory) ->
     
     return Var(name, None, category, id, status, flags, user_data)
 
-def read_variable_defs(section: bytes, category: VarCategory) -> list[Var]:
-    arr = enumerate(array('I', section))
+def read_variable_defs(section: memoryview, category: VarCategory) -> list[Var]:
+    arr = enumerate(section.cast('I'))
     
     count = next(arr)[1]
     variables = []
@@ -106,7 +105,8 @@ def write_variable(var: Var) -> array[int]:
         # string
         out.append(0)
     else:
-        out.append(int(var.user_data))
+        # Int content is read as s32
+        out.append(int(var.user_data) & 0xFFFFFFFF)
     
     if var.name is not None:
         out.extend(write_string(var.name))
@@ -117,15 +117,19 @@ def write_variable(var: Var) -> array[int]:
     
     return out
 
-def print_var(var: Var, indentation_level: int = 1) -> str:
-    indent = '  ' * indentation_level
-    
+def print_var_content(var: Var) -> str:
     if isinstance(var.user_data, str):
-        user_data = repr(var.user_data)
+        return repr(var.user_data)
+    elif isinstance(var.user_data, float):
+        return print_float(var.user_data)
     elif var.data_type in [0, 1] or var.user_data == 0:
-        user_data = str(var.user_data)
+        return str(var.user_data)
     else:
-        user_data = hex(var.user_data)
+        return hex(var.user_data)
+
+def print_var(var: Var, indentation_level: int = 1) -> str:
+    indent = '  ' * indentation_level
+    user_data = print_var_content(var)
     
     if var.data_type in VAR_TYPE_NAMES:
         type = VAR_TYPE_NAMES[var.data_type] + f" # {var.data_type}"
@@ -154,6 +158,39 @@ def print_var(var: Var, indentation_level: int = 1) -> str:
     
     return result
 
+def print_var_rows(vars: list[Var]) -> str:
+    # each variable as a single flow mapping, grouped by type like print_var.
+    # these sections are pure data, so this is much shorter than a line per field
+    rows: list[str] = []
+    prev_status = None
+    
+    for var in vars:
+        if prev_status != None and var.data_type != prev_status:
+            rows.append('  \n')
+        
+        prev_status = var.data_type
+        
+        row = '  - {'
+        
+        if var.name:
+            # quoted, as names can contain characters that end or nest a flow mapping
+            row += f"name: '{var.name.replace("'", "''")}', "
+        
+        if var.alias is not None:
+            row += f"alias: {var.category.name}:{var.alias}, "
+        
+        row += f"id: 0x{var.id:x}, type: {VAR_TYPE_NAMES.get(var.data_type, var.data_type)}"
+        
+        if var.flags != 0:
+            row += f", flags: 0x{var.flags:x}"
+        
+        if var.user_data != 0 or var.category == VarCategory.Const:
+            row += f", content: {print_var_content(var)}"
+        
+        rows.append(row + '}\n')
+    
+    return ''.join(rows)
+
 def var_from_yaml(var: Any, category: VarCategory) -> Var:
     assert isinstance(var, dict), "Variable has to be an object"
     
@@ -199,46 +236,25 @@ def var_from_yaml(var: Any, category: VarCategory) -> Var:
     
     return Var(name, alias, category, id, data_type, flags, content)
 
-def write_variables_yaml(sections: list[bytes], symbol_ids: SymbolIds):
-    # section 2
-    variables = read_variable_defs(sections[2], VarCategory.Static)
-    
-    var_str = 'static_variables:\n'
-    prev_status = None
-    for var in variables:
-        if prev_status != None and var.data_type != prev_status:
-            var_str += '  \n'
+def write_variables_yaml(sections: list[memoryview], symbol_ids: SymbolIds, f: TextIO, timings: Timings | None = None):
+    for section_index, category, key in [(2, VarCategory.Static, 'static_variables'),
+                                         (4, VarCategory.Const, 'constants'),
+                                         (6, VarCategory.Global, 'global_variables')]:
+        with timed(timings, 'section decode'):
+            variables = read_variable_defs(sections[section_index], category)
         
-        prev_status = var.data_type
-        symbol_ids.add(var)
-        var_str += print_var(var)
-    
-    # section 4
-    constants = read_variable_defs(sections[4], VarCategory.Const)
-    
-    var_str += '\nconstants:\n'
-    prev_status = None
-    for var in constants:
-        if prev_status != None and var.data_type != prev_status:
-            var_str += '  \n'
+        for var in variables:
+            symbol_ids.add(var)
         
-        prev_status = var.data_type
-        symbol_ids.add(var)
-        var_str += print_var(var)
-    
-    # section 6
-    global_variables = read_variable_defs(sections[6], VarCategory.Global)
-    
-    var_str += '\nglobal_variables:\n'
-    prev_status = None
-    for var in global_variables:
-        if prev_status != None and var.data_type != prev_status:
-            var_str += '  \n'
+        if section_index != 2:
+            f.write('\n')
         
-        prev_status = var.data_type
-        symbol_ids.add(var)
-        var_str += print_var(var)
+        f.write(f"{key}:\n")
+        f.write(print_var_rows(variables))
     
+    add_temp_vars(symbol_ids)
+
+def add_temp_vars(symbol_ids: SymbolIds):
     # temporary variables (defined implicitly)
     for i in range(20):
         var = Var(None, f"{i:X}", VarCategory.TempVar, 0x10000100 | i, 0, 0, 0)
@@ -249,24 +265,65 @@ def write_variables_yaml(sections: list[bytes], symbol_ids: SymbolIds):
         # good for passing previously uninitialized variables as out vars to a function
         var = Var(None, f"{i:X}", VarCategory.ClearTempVar, 0x10000400 | i, 0, 0, 0)
         symbol_ids.add(var)
+
+def write_variable_defs(vars: list[Var]) -> array[int]:
+    out = array('I')
+    out.append(len(vars))
+    
+    for var in vars:
+        out.extend(write_variable(var))
     
-    with open(argv[1] + '.variables.yaml', 'w', encoding='utf-8') as f:
-        f.write(var_str)
+    return out
 
-def parse_variables(var_input_file: dict, category_key: str, category: VarCategory, symbol_ids: SymbolIds) -> tuple[list[Var], bytearray]:
+def parse_variables(var_input_file: dict, category_key: str, category: VarCategory, symbol_ids: SymbolIds) -> list[Var]:
     if category_key not in var_input_file or var_input_file[category_key] is None:
-        return [], bytearray([0, 0, 0, 0])
+        return []
         
     assert isinstance(var_input_file[category_key], list), f"{category.name} variables have to be a list"
     
     vars_obj = var_input_file[category_key]
     vars = [var_from_yaml(var_obj, category) for var_obj in vars_obj]
     
-    out = array('I')
-    out.append(len(vars))
-    
     for var in vars:
         symbol_ids.add(var)
-        out.extend(write_variable(var))
     
-    return vars, bytearray(out)
+    return vars
+
+# constant lookup for the assembler
+class ConstantPool:
+    def __init__(self, constants: list[Var], intern_missing: bool = False):
+        self.constants = constants
+        self.intern_missing = intern_missing
+        self.interned_count = 0
+        
+        # new constants continue the ids of the existing ones
+        self.next_id = max((var.id for var in constants), default=0) + 1
+        
+        # the first constant with a given value wins, like a linear search would
+        self.by_value: dict[tuple[int, Any], Var] = {}
+        for var in constants:
+            self.by_value.setdefault((var.data_type, var.user_data), var)
+    
+    def get(self, data_type: int, value: Any) -> Var:
+        var = self.by_value.get((data_type, value))
+        
+        if var is None:
+            if not self.intern_missing:
+                raise ValueError(f"Could not find {VAR_TYPE_NAMES[data_type]} constant with content {value!r}")
+            
+            var = self.intern(data_type, value)
+        
+        return var
+    
+    def intern(self, data_type: int, value: Any) -> Var:
+        # there has to be an existing constant for the ids to start from
+        assert len(self.constants) > 0, f"Can't add {VAR_TYPE_NAMES[data_type]} constant {value!r} to a script without constants"
+        
+        var = Var(None, None, VarCategory.Const, self.next_id, data_type, 0, value)
+        self.next_id += 1
+        
+        self.constants.append(var)
+        self.by_value[data_type, value] = var
+        self.interned_count += 1
+        
+        return var